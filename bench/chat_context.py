@@ -0,0 +1,102 @@
+"""CPU на апдейт для «служебной» части хендлера: антиспам, хэш чата, событие в очередь логов.
+
+    python bench/chat_context.py --updates 200000 --chats 5000
+
+legacy  — как было: hash_chat_id и datetime.utcnow().isoformat() на каждый log_event,
+          в catch_time/erase хэш ещё раз; события в очереди — списки.
+context — ChatContext на апдейт: хэш из LRU (соль предварительно захэширована),
+          время один раз; события — EventRecord со __slots__.
+"""
+import argparse
+import hashlib
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime
+
+from fakes import install_fake_gspread
+
+# шаги воронки: (kind для rate_ok, событий log_event, нужен ли хэш для записи лида/erase)
+STEPS = [("flow", 1, False), ("flow", 1, False), ("flow", 1, False), ("flow", 1, False),
+         ("generate", 1, True), ("cheap", 1, False), ("cheap", 2, True)]
+
+
+def legacy_hash(salt, chat_id):
+    return hashlib.sha256(f"{salt}:{chat_id}".encode("utf-8")).hexdigest()
+
+
+def run_legacy(main, updates, buf, rate=True):
+    salt = main.HASH_SALT
+    for chat_id, (kind, events, needs_hash) in updates:
+        if rate:
+            main.rate_ok(chat_id, kind)
+        for _ in range(events):
+            buf.append([datetime.utcnow().isoformat(), legacy_hash(salt, chat_id), "event"])
+        if needs_hash:
+            legacy_hash(salt, chat_id)
+        if len(buf) > 5000:
+            buf.clear()
+
+
+def run_context(main, updates, buf, rate=True):
+    for chat_id, (kind, events, needs_hash) in updates:
+        chat = main.ChatContext(chat_id)
+        if rate:
+            main.rate_ok(chat.id, kind)
+        for _ in range(events):
+            buf.append(main.EventRecord(chat.ts, chat.hash, "event"))
+        if needs_hash:
+            chat.hash
+        if len(buf) > 5000:
+            buf.clear()
+
+
+def buffer_bytes(make, n=5000):
+    tracemalloc.start()
+    buf = [make(i) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del buf
+    return size
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--updates", type=int, default=200_000)
+    p.add_argument("--chats", type=int, default=5_000)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    os.environ["RATE_LIMIT_FLOW"] = "1000000,1000000"
+    os.environ["RATE_LIMIT_CHEAP"] = "1000000,1000000"
+    os.environ["RATE_LIMIT_GENERATE"] = "1000000,1000000"
+    install_fake_gspread()
+    import main
+
+    assert main.hash_chat_id(123) == legacy_hash(main.HASH_SALT, 123), "хэш изменился"
+    rnd = random.Random(1)
+    updates = [(rnd.randrange(args.chats), STEPS[i % len(STEPS)]) for i in range(args.updates)]
+
+    for rate in (True, False):
+        print("с rate_ok:" if rate else "только хэш + время + событие:")
+        for name, fn in (("legacy", run_legacy), ("context", run_context)):
+            best = float("inf")
+            for _ in range(args.repeat):  # лучший из повторов — меньше шума от соседей по CPU
+                main.hash_chat_id.cache_clear()
+                t0 = time.perf_counter()
+                fn(main, updates, [], rate)
+                best = min(best, time.perf_counter() - t0)
+            print(f"  {name:8s} {best / args.updates * 1e6:6.2f} us/update")
+
+    ts, h = datetime.utcnow().isoformat(), legacy_hash("s", 1)
+    lists = buffer_bytes(lambda i: [ts, h, "skills_provided"])
+    records = buffer_bytes(lambda i: main.EventRecord(ts, h, "skills_provided"))
+    print(f"log queue of 5000 events: lists {lists / 1024:.0f} KiB, EventRecord {records / 1024:.0f} KiB")
+    print(f"hash LRU: {main.hash_chat_id.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""/erase по листу на 100k строк: полный скан + delete_rows против SheetRowIndex.
+
+    python bench/erase_index.py --rows 100000 --erasures 20
+
+Время API моделируется: call_ms на вызов + cell_us на каждую переданную ячейку.
+"""
+import argparse
+import os
+import random
+import time
+
+from fakes import FakeWorksheet, install_fake_gspread
+
+
+def make_rows(n, users):
+    rows = [["timestamp", "chat_id_hash", "budget", "skills", "time_per_week", "ideas_text"]]
+    for i in range(n):
+        rows.append([f"2025-09-{1 + i * 29 // n:02d}T12:00:00", f"h{random.randrange(users)}",
+                     "5000", "чат-боты", ">10 часов/нед", "идеи"])
+    return rows
+
+
+def legacy_erase(ws, chat_id_hash):
+    data = ws.get_all_values()
+    to_delete = [idx for idx, row in enumerate(data[1:], start=2) if len(row) > 1 and row[1] == chat_id_hash]
+    for r in reversed(to_delete):
+        ws.delete_rows(r)
+    return len(to_delete)
+
+
+def measure(name, ws, erase, victims, args):
+    t0 = time.perf_counter()
+    deleted = sum(erase(h) for h in victims)
+    cpu = time.perf_counter() - t0
+    modeled = ws.calls * args.call_ms / 1000 + ws.cells * args.cell_us / 1e6
+    print(f"{name:8s} deleted={deleted:5d} api_calls={ws.calls:6d} cells={ws.cells:9d} "
+          f"cpu={cpu:.2f}s modeled_api={modeled:.1f}s")
+    return [r[1] for r in ws.rows]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--rows", type=int, default=100_000)
+    p.add_argument("--users", type=int, default=5_000)
+    p.add_argument("--erasures", type=int, default=20)
+    p.add_argument("--call-ms", type=float, default=150.0)
+    p.add_argument("--cell-us", type=float, default=2.0)
+    args = p.parse_args()
+
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    install_fake_gspread()
+    import main
+
+    random.seed(1)
+    rows = make_rows(args.rows, args.users)
+    victims = random.sample(sorted({r[1] for r in rows[1:]}), args.erasures)
+
+    legacy_ws = FakeWorksheet(rows)
+    left_legacy = measure("legacy", legacy_ws, lambda h: legacy_erase(legacy_ws, h), victims, args)
+
+    indexed_ws = FakeWorksheet(rows)
+    index = main.SheetRowIndex(indexed_ws)
+    left_indexed = measure("indexed", indexed_ws, index.delete_by_hash, victims, args)
+
+    assert left_legacy == left_indexed, "результаты удаления разошлись"
+    print("OK: итоговые листы совпадают")
+
+
+if __name__ == "__main__":
+    main()
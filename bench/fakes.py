@@ -0,0 +1,514 @@
+"""Локальные фейки для бенчмарков: HTTP-сервер OpenAI, gspread и объекты апдейтов.
+
+Ничего не ходит в сеть — всё поднимается на 127.0.0.1 внутри процесса.
+"""
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+# ---------- Мини HTTP-сервер ----------
+class FakeHTTPServer:
+    """asyncio HTTP/1.1 сервер: routes = {(method, path_suffix): async handler(body) -> (status, dict)}."""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.server = None
+        self.port = None
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def _route(self, method, path):
+        path = path.split("?", 1)[0]
+        for (m, suffix), handler in self.routes.items():
+            if m == method and path.endswith(suffix):
+                return handler
+        return None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, path, _ = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = h.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                self.requests += 1
+                handler = self._route(method, path)
+                if handler is None:
+                    status, payload, extra = 404, {"error": "not found"}, {}
+                else:
+                    status, payload, *rest = await handler(body, headers)
+                    extra = rest[0] if rest else {}
+                head = [f"HTTP/1.1 {status} X"]
+                if "Content-Type" not in extra:
+                    head.append("Content-Type: application/json")
+                head += [f"{k}: {v}" for k, v in extra.items()]
+                if hasattr(payload, "__aiter__"):  # стрим: chunked transfer
+                    head.append("Transfer-Encoding: chunked")
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                    async for piece in payload:
+                        piece = piece.encode("utf-8")
+                        writer.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+                        await writer.drain()
+                    writer.write(b"0\r\n\r\n")
+                else:
+                    data = json.dumps(payload).encode("utf-8")
+                    head.append(f"Content-Length: {len(data)}")
+                    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+# ---------- OpenAI ----------
+IDEAS_TEXT = (
+    "1) *Бот-консультант* — отвечает на вопросы клиентов ниши.\n"
+    "Шаги: собрать FAQ, настроить промпт, запустить в Telegram.\n"
+    "Монетизация: подписка.\n\n"
+    "2) *Генератор контента* — посты и сценарии под нишу.\n"
+    "Шаги: шаблоны, тест на 5 клиентах, прайс.\n"
+    "Монетизация: пакеты.\n\n"
+    "3) *Шаблоны промптов* — набор воркфлоу под одну боль.\n"
+    "Шаги: интервью, сборка, лендинг.\n"
+    "Монетизация: разовая продажа + апсейл.\n"
+)
+
+
+def openai_routes(latency=1.0, jitter=0.2, error_rate=0.0, text=IDEAS_TEXT, ttft=0.3, pieces=40, per_token=0.0):
+    """Роуты, имитирующие /v1/chat/completions с задержкой генерации.
+
+    latency — полное время ответа; при stream=true первый кусок приходит через ttft,
+    остальные pieces кусков равномерно до latency. per_token — добавка за каждый токен
+    ответа (токен ~ 3 символа); ответ обрезается по max_tokens с finish_reason="length".
+    """
+    stats = SimpleNamespace(calls=0, errors=0, completion_tokens=0)
+
+    def answer(req):
+        out = text
+        limit = req.get("max_tokens")
+        if limit and len(out) > limit * 3:
+            return out[:limit * 3], limit, "length"
+        return out, max(1, len(out) // 3), "stop"
+
+    def usage(req, tokens):
+        prompt = sum(len(m.get("content", "")) for m in req.get("messages", [])) // 3
+        stats.completion_tokens += tokens
+        return {"prompt_tokens": prompt, "completion_tokens": tokens, "total_tokens": prompt + tokens}
+
+    async def sse(req, total):
+        out, tokens, finish = answer(req)
+        total += tokens * per_token
+        first = min(ttft, total)
+        await asyncio.sleep(first)
+        step = max(1, len(out) // pieces)
+        chunks = [out[i:i + step] for i in range(0, len(out), step)]
+        pause = (total - first) / max(1, len(chunks))
+
+        def chunk(choices, **extra):
+            return "data: " + json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": req.get("model", "gpt-4o-mini"), "choices": choices, **extra,
+            }) + "\n\n"
+
+        for i, piece in enumerate(chunks):
+            last = i == len(chunks) - 1
+            yield chunk([{"index": 0, "delta": {"content": piece}, "finish_reason": finish if last else None}])
+            await asyncio.sleep(pause)
+        if (req.get("stream_options") or {}).get("include_usage"):
+            yield chunk([], usage=usage(req, tokens))
+        yield "data: [DONE]\n\n"
+
+    async def completions(body, headers):
+        stats.calls += 1
+        req = json.loads(body or b"{}")
+        total = max(0.0, latency + random.uniform(-jitter, jitter))
+        if random.random() < error_rate:
+            await asyncio.sleep(total)
+            stats.errors += 1
+            return 500, {"error": {"message": "fake failure", "type": "server_error"}}
+        if req.get("stream"):
+            return 200, sse(req, total), {"Content-Type": "text/event-stream"}
+        out, tokens, finish = answer(req)
+        await asyncio.sleep(total + tokens * per_token)
+        return 200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": req.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": out},
+                "finish_reason": finish,
+            }],
+            "usage": usage(req, tokens),
+        }
+
+    return {("POST", "/chat/completions"): completions}, stats
+
+
+# ---------- Telegram Bot API ----------
+class FloodControl:
+    """Лимиты Telegram как token bucket: global_limit и chat_limit — (в секунду, всплеск).
+    check() возвращает 0, если можно, иначе retry_after в целых секундах."""
+
+    def __init__(self, global_limit, chat_limit):
+        self.limits = {"global": global_limit, "chat": chat_limit}
+        self.buckets = {}
+
+    def _take(self, key, rate, burst, now):
+        tokens, t = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - t) * rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self.buckets[key] = (tokens - 1, now)
+        return 0.0
+
+    def check(self, chat_id):
+        now = time.monotonic()
+        wait = self._take(("chat", chat_id), *self.limits["chat"], now)
+        if not wait:
+            wait = self._take("global", *self.limits["global"], now)
+            if wait:  # слот чата не тратим
+                tokens, t = self.buckets[("chat", chat_id)]
+                self.buckets[("chat", chat_id)] = (tokens + 1, t)
+        return math.ceil(wait) if wait else 0
+
+
+def bot_api_routes(latency=0.0, error_rate=0.0, flood=None):
+    """Роуты фейкового Bot API (для TELEGRAM_API_URL). stats.sent — [(метод, chat_id, text, t)],
+    stats.listeners — колбэки fn(метод, chat_id, text) на каждое доставленное сообщение.
+
+    flood — FloodControl: сверх лимитов отвечаем 429 с retry_after, как Telegram.
+    """
+    stats = SimpleNamespace(sent=[], calls=0, errors=0, waiters=[], listeners=[], get_me=0, webhooks=0, flooded=0)
+    counter = itertools.count(1)
+
+    def message(params):
+        chat_id = int(json.loads(params.get("chat_id", "0")))
+        return {
+            "message_id": next(counter), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+        }
+
+    async def get_me(body, headers):
+        stats.get_me += 1
+        return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+
+    def sender(method):
+        async def handle(body, headers):
+            stats.calls += 1
+            if latency:
+                await asyncio.sleep(latency)
+            if random.random() < error_rate:
+                stats.errors += 1
+                return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            params = {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+            retry_after = flood.check(params.get("chat_id")) if flood else 0
+            if retry_after:
+                stats.flooded += 1
+                return 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": retry_after},
+                             "description": f"Too Many Requests: retry after {retry_after}"}
+            msg = message(params)
+            stats.sent.append((method, msg["chat"]["id"], msg["text"], time.perf_counter()))
+            for listener in stats.listeners:
+                listener(method, msg["chat"]["id"], msg["text"])
+            for fut in list(stats.waiters):
+                if not fut.done():
+                    fut.set_result(None)
+            stats.waiters.clear()
+            return 200, {"ok": True, "result": msg}
+        return handle
+
+    async def ok_true(body, headers):
+        return 200, {"ok": True, "result": True}
+
+    async def set_webhook(body, headers):
+        stats.webhooks += 1
+        return 200, {"ok": True, "result": True}
+
+    routes = {
+        ("POST", "/getMe"): get_me,
+        ("POST", "/sendMessage"): sender("sendMessage"),
+        ("POST", "/editMessageText"): sender("editMessageText"),
+        ("POST", "/deleteWebhook"): ok_true,
+        ("POST", "/setWebhook"): set_webhook,
+    }
+    return routes, stats
+
+
+async def wait_sent(stats, count, timeout=30.0):
+    """Ждёт, пока фейковый Bot API получит count сообщений."""
+    deadline = time.perf_counter() + timeout
+    while len(stats.sent) < count:
+        fut = asyncio.get_running_loop().create_future()
+        stats.waiters.append(fut)
+        await asyncio.wait_for(fut, max(0.001, deadline - time.perf_counter()))
+
+
+def make_update(update_id, chat_id, text):
+    """Словарь апдейта в формате Bot API (для Update.de_json)."""
+    msg = {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+    }
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": msg}
+
+
+class Users:
+    """Ждёт ответов бота по chat_id: шаг считается отвеченным, когда пришло новое sendMessage,
+    а для шага со временем — итоговая правка заглушки."""
+
+    def __init__(self, stats):
+        self.waiting = {}  # chat_id -> (predicate, future)
+        stats.listeners.append(self.on_sent)
+
+    def on_sent(self, method, chat_id, text):
+        entry = self.waiting.get(chat_id)
+        if entry and entry[0](method, text) and not entry[1].done():
+            entry[1].set_result(None)
+
+    async def wait(self, chat_id, predicate, timeout):
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting[chat_id] = (predicate, fut)
+        try:
+            await asyncio.wait_for(fut, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting.pop(chat_id, None)
+
+
+def any_send(method, text):
+    return method == "sendMessage"
+
+
+def ideas_done(method, text):
+    return method == "editMessageText" and text.startswith("✅")
+
+
+# ---------- gspread ----------
+class FakeWorksheet:
+    """Worksheet в памяти: строки — списки строк, 1-я строка — заголовок.
+
+    latency — задержка на каждый вызов API, cell_cost — на каждую переданную ячейку.
+    """
+
+    def __init__(self, rows=None, latency=0.0, cell_cost=0.0, title="Sheet1", sheet_id=0, error_rate=0.0):
+        self.rows = [list(r) for r in (rows or [])]
+        self.latency = latency
+        self.cell_cost = cell_cost
+        self.error_rate = error_rate
+        self.errors = 0
+        self.title = title
+        self.id = sheet_id
+        self.calls = 0
+        self.cells = 0
+        self.spreadsheet = FakeSpreadsheet(self)
+
+    def _io(self, cells=0):
+        self.calls += 1
+        self.cells += cells
+        delay = self.latency + cells * self.cell_cost
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            raise RuntimeError("fake Sheets API error")
+
+    def row_values(self, i):
+        self._io()
+        return list(self.rows[i - 1]) if len(self.rows) >= i else []
+
+    def col_values(self, col):
+        values = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        while values and not values[-1]:
+            values.pop()
+        self._io(len(values))
+        return values
+
+    def get_all_values(self):
+        self._io(sum(len(r) for r in self.rows))
+        return [list(r) for r in self.rows]
+
+    def get(self, range_name):
+        (c1, r1), (c2, r2) = (_a1(p) for p in range_name.split(":"))
+        out = [r[c1 - 1:c2] for r in self.rows[r1 - 1:r2]]
+        self._io(sum(len(r) for r in out))
+        return out
+
+    def batch_get(self, ranges):
+        self.calls += 1
+        out = [self.get(r) for r in ranges]
+        self.calls -= len(ranges)
+        return out
+
+    def clear(self):
+        self._io()
+        self.rows = []
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row])
+
+    def append_rows(self, rows, **kwargs):
+        self._io(sum(len(r) for r in rows))
+        first = len(self.rows) + 1
+        self.rows.extend([str(v) for v in r] for r in rows)
+        return {"updates": {"updatedRange": f"{self.title}!A{first}:F{len(self.rows)}"}}
+
+    def delete_rows(self, start, end=None):
+        self._io()
+        end = end or start
+        del self.rows[start - 1:end]
+
+
+def _a1(cell):
+    letters = "".join(ch for ch in cell if ch.isalpha())
+    digits = "".join(ch for ch in cell if ch.isdigit())
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch.upper()) - 64
+    return col, int(digits)
+
+
+class FakeSpreadsheet:
+    def __init__(self, ws):
+        self.sheet1 = ws
+
+    def batch_update(self, body):
+        ws = self.sheet1
+        ws._io()
+        for req in body["requests"]:
+            rng = req["deleteDimension"]["range"]
+            del ws.rows[rng["startIndex"]:rng["endIndex"]]
+        return {}
+
+
+class FakeGspreadClient:
+    def __init__(self, sheets, ws_latency=0.0, error_rate=0.0):
+        self.sheets = sheets
+        self.ws_latency = ws_latency
+        self.error_rate = error_rate
+
+    def open_by_key(self, key):
+        if key not in self.sheets:
+            self.sheets[key] = FakeWorksheet(latency=self.ws_latency, error_rate=self.error_rate)
+        return self.sheets[key].spreadsheet
+
+
+def quiet_logs():
+    import logging
+    for name in ("httpx", "httpcore", "openai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def install_fake_gspread(latency=0.0, ws_latency=0.0, error_rate=0.0):
+    """Подменяет gspread.authorize и Credentials до импорта main. Возвращает словарь листов.
+    error_rate — доля вызовов листа, которые падают (уже после задержки)."""
+    import gspread
+    from google.oauth2 import service_account
+
+    sheets = {}
+    os.environ.setdefault("GOOGLE_CREDENTIALS_JSON", "{}")
+    service_account.Credentials.from_service_account_info = classmethod(lambda cls, *a, **kw: None)
+
+    def authorize(creds):
+        if latency:
+            time.sleep(latency)
+        return FakeGspreadClient(sheets, ws_latency, error_rate)
+
+    gspread.authorize = authorize
+    return sheets
+
+
+# ---------- Апдейты для прямого вызова хендлеров ----------
+class FakeMessage:
+    """Сообщение с reply_text/edit_text; всё отправленное пишется в sent: (chat_id, вид, текст, время)."""
+
+    def __init__(self, chat_id, text="", sent=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.sent = sent if sent is not None else []
+
+    async def reply_text(self, text, **kwargs):
+        self.sent.append((self.chat_id, "send", text, time.perf_counter()))
+        return FakeMessage(self.chat_id, text, self.sent)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.sent.append((self.chat_id, "edit", text, time.perf_counter()))
+        return self
+
+
+def fake_update(chat_id, text="", sent=None):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        message=FakeMessage(chat_id, text, sent),
+    )
+
+
+def fake_context(user_data=None):
+    async def send_message(**kwargs):
+        return None
+
+    return SimpleNamespace(
+        user_data=user_data if user_data is not None else {},
+        bot=SimpleNamespace(send_message=send_message),
+        application=SimpleNamespace(create_task=asyncio.create_task, drop_user_data=lambda user_id: None,
+                                    persistence=None),
+    )
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = min(len(s) - 1, max(0, int(round(p / 100 * (len(s) - 1)))))
+    return s[k]
+
+
+async def loop_lag_probe(stop, interval=0.01):
+    """Замеряет максимальную задержку event loop (сколько его блокировали)."""
+    worst = 0.0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - t0 - interval)
+    return worst
@@ -0,0 +1,269 @@
+"""Вся воронка через настоящий build_app(): /start → СОГЛАСЕН → бюджет → навыки → время,
+потом /privacy и /erase. Bot API, OpenAI и Google Sheets — локальные фейки с задержками и ошибками.
+
+    python bench/funnel.py --chats 200 --openai-latency 1.5
+    python bench/funnel.py --replay leads.csv --speed 0          # ответы из выгрузки лидов, без пауз
+    python bench/funnel.py --replay updates.jsonl                 # сырые апдейты Bot API, по строке
+    python bench/funnel.py --chats 0 --flood 60 --telegram-limits # один чат флудит — ждёт ли другой?
+
+Каждый «пользователь» отвечает, только когда бот ответил на предыдущий шаг (плюс --think).
+Печатает пропускную способность, перцентили по хендлерам, блокировку event loop и
+счётчики ошибок — удобно сравнивать прогоны до и после изменений в хранилище или генерации.
+"""
+import argparse
+import asyncio
+import csv
+import functools
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from fakes import (
+    FakeHTTPServer, Users, any_send, bot_api_routes, ideas_done, install_fake_gspread,
+    loop_lag_probe, make_update, openai_routes, percentile, quiet_logs,
+)
+
+BUDGETS = ["0", "1000", "5 000", "10к", "50000", "100 000 руб"]
+SKILLS = ["чат-боты, ии", "дизайн", "маркетинг, тексты", "python", "игры, боты", "продажи"]
+TIMES = [">10 часов/нед", ">10 часов/нед", "5-10 ч", "3 часа", "1 час в день"]
+LEADS_SHEET_KEY = "1uo3yOGDLrA5d9PCeZSEfVepcIuk3raYlFKTpFeVlWgQ"  # как в connect_sheet
+
+
+def synthetic(n):
+    """Ответы n пользователей: (chat_id, budget, skills, time, смещение старта в секундах)."""
+    rnd = random.Random(1)
+    return [(100_000 + i, rnd.choice(BUDGETS), rnd.choice(SKILLS), rnd.choice(TIMES), 0.0) for i in range(n)]
+
+
+def from_leads_csv(path):
+    """leads.csv (timestamp,user_id,username,budget,skills,time) -> те же кортежи плюс смещение по времени.
+    Один user_id может пройти воронку несколько раз — каждый проход отдельным чатом."""
+    with open(path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    times = [datetime_ts(r["timestamp"]) for r in rows]
+    t0 = min(times) if times else 0.0
+    return [(200_000 + i, r["budget"], r["skills"], r["time"], t - t0) for i, (r, t) in enumerate(zip(rows, times))]
+
+
+def datetime_ts(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def time_handlers(app, samples):
+    """Оборачивает колбэки всех хендлеров (и внутри ConversationHandler) замером времени."""
+    from telegram.ext import ConversationHandler
+
+    def wrap(handler):
+        fn = handler.callback
+        name = getattr(fn, "__name__", "handler")
+
+        @functools.wraps(fn)
+        async def timed(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await fn(update, context)
+            finally:
+                samples.setdefault(name, []).append(time.perf_counter() - t0)
+        handler.callback = timed
+
+    for group in app.handlers.values():
+        for h in group:
+            if isinstance(h, ConversationHandler):
+                for inner in h.entry_points + h.fallbacks + [x for hs in h.states.values() for x in hs]:
+                    wrap(inner)
+            else:
+                wrap(h)
+
+
+async def run(args):
+    oa_routes, oa_stats = openai_routes(latency=args.openai_latency, jitter=args.openai_latency * 0.2,
+                                        error_rate=args.openai_errors)
+    tg_routes, tg_stats = bot_api_routes(latency=args.telegram_latency, error_rate=args.telegram_errors)
+    openai_server = await FakeHTTPServer(oa_routes).start()
+    telegram_server = await FakeHTTPServer(tg_routes).start()
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": telegram_server.base_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": openai_server.base_url + "/v1",
+        "LOG_SHEET_ID": "logs",
+        "LEADS_DB_PATH": os.path.join(tmp, "leads.db"),
+        "PERSISTENCE_PATH": os.path.join(tmp, "state.db"),
+        "SHEET_SYNC_SEC": "1",
+        "LOG_FLUSH_SEC": "1",
+        # меряем сам бот: антиспам и лимиты Telegram не должны резать синтетических пользователей
+        "RATE_LIMIT_CHEAP": "100,100",
+        "RATE_LIMIT_FLOW": "100,100",
+        "RATE_LIMIT_GENERATE": "100,100",
+    })
+    if not args.telegram_limits:
+        os.environ["SEND_LIMIT_GLOBAL"] = "100000,100000"
+        os.environ["SEND_LIMIT_CHAT"] = "1000,1000"
+    sheets = install_fake_gspread(latency=args.sheets_latency, ws_latency=args.sheets_latency,
+                                  error_rate=args.sheets_errors)
+    import main
+    from telegram import Update
+    quiet_logs()
+    main.log.setLevel("ERROR")
+    for name in ("telegram", "apscheduler"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    app = main.build_app()
+    samples = {}
+    time_handlers(app, samples)
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    await main._INIT_TASK
+
+    users = Users(tg_stats)
+    update_ids = iter(range(1, 10**9))
+    done, stuck = [], []
+
+    async def say(chat_id, text, predicate=any_send):
+        """Шаг пользователя: апдейт — в app.update_queue, как от polling/webhook; ждём только
+        ответа бота. Порядок внутри чата держит сам Application (ChatOrderedApplication)."""
+        update = Update.de_json(make_update(next(update_ids), chat_id, text), app.bot)
+        waiter = asyncio.ensure_future(users.wait(chat_id, predicate, args.step_timeout))
+        await asyncio.sleep(0)  # ожидание ответа регистрируем раньше, чем апдейт обработают
+        await app.update_queue.put(update)
+        return await waiter
+
+    async def think():
+        if args.think:
+            await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+
+    async def user(chat_id, budget, skills, timepw, offset, gate):
+        if offset and args.speed:
+            await asyncio.sleep(offset / args.speed)
+        async with gate:
+            t0 = time.perf_counter()
+            steps = [("/start", any_send), ("СОГЛАСЕН", any_send), (budget, any_send),
+                     (skills, any_send), (timepw, ideas_done), ("/privacy", any_send), ("/erase", any_send)]
+            for text, predicate in steps:
+                if not await say(chat_id, text, predicate):
+                    stuck.append((chat_id, text))
+                    return
+                await think()
+            done.append(time.perf_counter() - t0)
+
+    async def replay_updates(path, gate):
+        """Сырые апдейты из JSONL: внутри чата — строго по порядку, чаты — параллельно."""
+        chats = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    update = Update.de_json(json.loads(line), app.bot)
+                    chats.setdefault(update.effective_chat.id, []).append(update)
+
+        async def one_chat(updates):
+            async with gate:
+                for update in updates:
+                    await app.update_queue.put(update)
+                    await think()
+        await asyncio.gather(*(one_chat(u) for u in chats.values()))
+        while app.update_queue.qsize() or len(app._chat_queues):  # дожидаемся обработки хвоста
+            await asyncio.sleep(0.05)
+
+    async def flood(n):
+        """Один чат разом шлёт n неверных ответов на согласие (каждый ждёт ответа по лимиту
+        чата), потом другой чат — /privacy. Очередь флудящего чата не должна занимать слоты
+        concurrent_updates: латентность /privacy — доли секунды при любом n."""
+        flooder = 900_000
+        if not await say(flooder, "/start"):
+            return None
+        for _ in range(n):
+            await app.update_queue.put(Update.de_json(make_update(next(update_ids), flooder, "нет"), app.bot))
+        await asyncio.sleep(0.2)  # диспетчер разобрал флуд
+        t0 = time.perf_counter()
+        ok = await say(flooder + 1, "/privacy")
+        return time.perf_counter() - t0 if ok else None
+
+    if args.flood:
+        latency = await flood(args.flood)
+        shown = f"{latency:.2f}s" if latency is not None else f"нет ответа за {args.step_timeout:.0f}s"
+        print(f"flood: {args.flood} updates from one chat -> /privacy in another chat: {shown} "
+              f"({'ok' if latency is not None and latency < 1.0 else 'FAIL'})")
+
+    gate = asyncio.Semaphore(args.concurrency)
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    t_start = time.perf_counter()
+    if args.replay and args.replay.endswith(".jsonl"):
+        flows = []
+        await replay_updates(args.replay, gate)
+    else:
+        flows = from_leads_csv(args.replay) if args.replay else synthetic(args.chats)
+        await asyncio.gather(*(user(*flow, gate) for flow in flows))
+    wall = time.perf_counter() - t_start
+    stop.set()
+    lag = await probe
+
+    await app.stop()  # сначала останавливаем job_queue, чтобы досинхронизация не шла параллельно с job
+    await main.EVENT_LOG.flush()
+    await main.sync_sheet_replica(None)
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await openai_server.stop()
+    await telegram_server.stop()
+
+    source = args.replay or f"synthetic x{args.chats}"
+    print(f"source={source} concurrency={args.concurrency} think={args.think}s "
+          f"openai={args.openai_latency}s/{args.openai_errors:.0%} telegram={args.telegram_latency}s/"
+          f"{args.telegram_errors:.0%} sheets={args.sheets_latency}s/{args.sheets_errors:.0%}")
+    if flows:
+        print(f"funnels: done={len(done)}/{len(flows)} stuck={len(stuck)} wall={wall:.2f}s "
+              f"throughput={len(done) / wall:.1f} funnels/s  p50={percentile(done, 50):.2f}s "
+              f"p99={percentile(done, 99):.2f}s")
+    else:
+        print(f"updates: wall={wall:.2f}s handled={sum(len(v) for v in samples.values())}")
+    print(f"{'handler':16s} {'n':>6s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s}")
+    for name, values in sorted(samples.items()):
+        print(f"{name:16s} {len(values):6d} {percentile(values, 50) * 1000:8.1f} {percentile(values, 95) * 1000:8.1f} "
+              f"{percentile(values, 99) * 1000:8.1f} {max(values) * 1000:8.1f}")
+
+    def rows(key):
+        return len(sheets[key].rows) - 1 if key in sheets else 0
+
+    def counters(name):
+        return {",".join(v for _, v in labels): n for (metric, labels), n in main.METRICS.counters.items()
+                if metric == name}
+
+    errors, fallbacks = counters("bot_errors_total"), counters("bot_fallbacks_total")
+    print(f"max_loop_block={lag * 1000:.1f}ms  bot_api_calls={tg_stats.calls} openai_calls={oa_stats.calls} "
+          f"sheet_rows={rows(LEADS_SHEET_KEY)} log_rows={rows('logs')}")
+    print(f"errors={errors or 0} fallbacks={fallbacks or 0}")
+    if stuck:
+        print(f"stuck at: {sorted({text for _, text in stuck})}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--chats", type=int, default=200, help="синтетических пользователей")
+    p.add_argument("--replay", help="leads.csv-подобный CSV или JSONL с сырыми апдейтами")
+    p.add_argument("--speed", type=float, default=0.0,
+                   help="для CSV: во сколько раз ускорить реальные интервалы между лидами (0 — все сразу)")
+    p.add_argument("--concurrency", type=int, default=100, help="одновременно проходящих воронку")
+    p.add_argument("--think", type=float, default=0.0, help="пауза пользователя между шагами, с")
+    p.add_argument("--step-timeout", type=float, default=60.0)
+    p.add_argument("--flood", type=int, default=0, help="до воронок: столько апдейтов разом от одного чата")
+    p.add_argument("--openai-latency", type=float, default=1.0)
+    p.add_argument("--openai-errors", type=float, default=0.0)
+    p.add_argument("--telegram-latency", type=float, default=0.02)
+    p.add_argument("--telegram-errors", type=float, default=0.0)
+    p.add_argument("--telegram-limits", action="store_true", help="оставить лимиты отправки как в бою")
+    p.add_argument("--sheets-latency", type=float, default=0.15)
+    p.add_argument("--sheets-errors", type=float, default=0.0)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
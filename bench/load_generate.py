@@ -0,0 +1,155 @@
+"""Нагрузочный тест генерации идей через настоящий build_app() против фейковых OpenAI и Bot API.
+
+    python bench/load_generate.py --chats 50 --latency 1.5
+
+Апдейты кладутся в app.update_queue, как их кладёт polling/webhook, — то есть проходят
+через диспетчер Application и ConversationHandler. Печатает p50/p99 от ответа про время
+до итоговых идей, время до первого видимого текста (стриминг в заглушку), латентность
+ответа на /privacy в другом чате посреди генераций (диспетчер не должен ждать OpenAI)
+и максимальную блокировку event loop.
+
+    python bench/load_generate.py --think 3 --speculative --other-time 0.3
+
+--think — пауза «пользователь печатает» между ответом про навыки и про время; с --speculative
+генерация стартует уже в catch_skills (доля --other-time отвечает не из угаданной корзины).
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+
+from fakes import (
+    FakeHTTPServer, Users, any_send, bot_api_routes, ideas_done, install_fake_gspread,
+    loop_lag_probe, make_update, openai_routes, percentile, quiet_logs,
+)
+
+
+async def run(args):
+    routes, stats = openai_routes(latency=args.latency, jitter=args.latency * 0.2, error_rate=args.error_rate,
+                                  per_token=args.per_token)
+    server = await FakeHTTPServer(routes).start()
+    tg_routes, tg_stats = bot_api_routes()
+    telegram = await FakeHTTPServer(tg_routes).start()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:bench",
+        "TELEGRAM_API_URL": telegram.base_url,
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": server.base_url + "/v1",
+        "OPENAI_MAX_CONCURRENCY": str(args.concurrency),
+        "OPENAI_TIMEOUT_SEC": str(args.timeout),
+        "LEADS_DB_PATH": os.path.join(tmp, "leads.db"),
+        "PERSISTENCE_PATH": os.path.join(tmp, "state.db"),
+        # меряем генерацию, а не антиспам и лимиты Telegram
+        "RATE_LIMIT_CHEAP": "100,100",
+        "RATE_LIMIT_FLOW": "100,100",
+        "RATE_LIMIT_GENERATE": "100,100",
+        "SEND_LIMIT_GLOBAL": "100000,100000",
+        "SEND_LIMIT_CHAT": "1000,1000",
+    })
+    os.environ.pop("ADMIN_CHAT_ID", None)
+    install_fake_gspread()
+    import main
+    from telegram import Update
+    quiet_logs()
+    for name in ("telegram", "apscheduler"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+    main.SPECULATIVE_IDEAS = args.speculative
+
+    app = main.build_app()
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    await main._INIT_TASK
+    # прогрев: первая генерация лениво импортирует модели openai
+    await main.generate_ideas("0", "-", "-")
+    stats.calls = 0
+
+    users = Users(tg_stats)
+    update_ids = itertools.count(1)
+    first_edit = {}  # chat_id -> время первой правки заглушки
+
+    def on_sent(method, chat_id, text):
+        if method == "editMessageText":
+            first_edit.setdefault(chat_id, time.perf_counter())
+    tg_stats.listeners.append(on_sent)
+
+    async def say(chat_id, text, predicate=any_send):
+        waiter = asyncio.ensure_future(users.wait(chat_id, predicate, args.timeout * 2))
+        await asyncio.sleep(0)
+        await app.update_queue.put(Update.de_json(make_update(next(update_ids), chat_id, text), app.bot))
+        return await waiter
+
+    async def one_chat(chat_id):
+        skills = "чат-боты, ии" if args.same_inputs else f"чат-боты, ии, тема {chat_id}"
+        for text in ("/start", "СОГЛАСЕН", "5000", skills):
+            await say(chat_id, text)
+        await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+        timepw = "3 часа" if random.random() < args.other_time else ">10 часов/нед"
+        t0 = time.perf_counter()
+        ok = await say(chat_id, timepw, ideas_done)
+        t_done = time.perf_counter()
+        first_visible.append(first_edit.get(chat_id, t_done) - t0)
+        return (t_done - t0) if ok else None
+
+    async def bystander():
+        """Другой чат шлёт /privacy, пока идут генерации: ждёт ли он OpenAI?"""
+        await asyncio.sleep(args.think + 0.05)
+        while not generating.done():
+            t0 = time.perf_counter()
+            await say(1, "/privacy")
+            bystander_lat.append(time.perf_counter() - t0)
+            await asyncio.sleep(0.05)
+
+    first_visible, bystander_lat = [], []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(loop_lag_probe(stop))
+    t0 = time.perf_counter()
+    generating = asyncio.gather(*(one_chat(1000 + i) for i in range(args.chats)))
+    await bystander()
+    latencies = [x for x in await generating if x is not None]
+    wall = time.perf_counter() - t0
+    stop.set()
+    worst_lag = await probe
+
+    await app.stop()
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await server.stop()
+    await telegram.stop()
+
+    print(f"chats={args.chats} concurrency={args.concurrency} fake_latency={args.latency}s")
+    print(f"wall={wall:.2f}s  done={len(latencies)}/{args.chats}  p50={percentile(latencies, 50):.3f}s  "
+          f"p99={percentile(latencies, 99):.3f}s  max={max(latencies, default=0):.3f}s")
+    print(f"first visible text: p50={percentile(first_visible, 50):.3f}s  p99={percentile(first_visible, 99):.3f}s")
+    print(f"/privacy in another chat during generation: n={len(bystander_lat)} "
+          f"p50={percentile(bystander_lat, 50) * 1000:.1f}ms  max={max(bystander_lat, default=0) * 1000:.1f}ms")
+    print(f"openai_calls={stats.calls} openai_errors={stats.errors}  max_loop_block={worst_lag * 1000:.1f}ms")
+    print(f"ideas_cache={main.IDEAS_CACHE.stats()}")
+    print(f"tokens={main.TOKENS.stats()}")
+    if args.speculative:
+        print(f"speculative={main.SPECULATOR.stats()}")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--chats", type=int, default=50)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--latency", type=float, default=1.5)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--think", type=float, default=0.0, help="секунд между ответом про навыки и про время")
+    p.add_argument("--speculative", action="store_true", help="генерация сразу после навыков")
+    p.add_argument("--other-time", type=float, default=0.0, help="доля ответов не из самой частой корзины")
+    p.add_argument("--per-token", type=float, default=0.0, help="секунд генерации на токен ответа")
+    p.add_argument("--same-inputs", action="store_true", help="все чаты с одинаковыми ответами (кэш/дедупликация)")
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Накладные расходы SqlitePersistence на апдейт.
+
+    python bench/persistence.py --updates 20000
+
+naive      — коммит после каждой записи (как если бы писали на каждый апдейт);
+coalesced  — как в боте: PTB копит изменения и раз в update_interval отдаёт пачку,
+             которая уходит одной транзакцией.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fakes import install_fake_gspread
+
+
+async def run(args):
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    install_fake_gspread()
+    import main
+
+    def user_data(i):
+        return {"budget": str(i * 100), "skills": "чат-боты, ии", "time_per_week": ">10 часов/нед"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        p = main.SqlitePersistence(os.path.join(tmp, "naive.db"))
+        t0 = time.perf_counter()
+        for i in range(args.updates):
+            await p.update_user_data(i % args.users, user_data(i))
+            await p.update_conversation("interview", (i % args.users, i % args.users), i % 4)
+            p._commit()
+        naive = (time.perf_counter() - t0) / args.updates
+
+        p = main.SqlitePersistence(os.path.join(tmp, "coalesced.db"))
+        t0 = time.perf_counter()
+        done = 0
+        while done < args.updates:
+            batch = range(done, min(args.updates, done + args.batch))
+            for i in batch:
+                await p.update_user_data(i % args.users, user_data(i))
+                await p.update_conversation("interview", (i % args.users, i % args.users), i % 4)
+            await asyncio.sleep(0)  # отложенный commit
+            done += len(batch)
+        coalesced = (time.perf_counter() - t0) / args.updates
+
+        t0 = time.perf_counter()
+        restored = await p.get_conversations("interview")
+        users = await p.get_user_data()
+        load = time.perf_counter() - t0
+
+    print(f"updates={args.updates} users={args.users} batch={args.batch}")
+    print(f"naive:     {naive * 1e6:8.1f} us/update")
+    print(f"coalesced: {coalesced * 1e6:8.1f} us/update ({p.commits} commits for {p.writes} writes)")
+    print(f"restore:   {len(restored)} conversations, {len(users)} users in {load * 1000:.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=20_000)
+    ap.add_argument("--users", type=int, default=2_000)
+    ap.add_argument("--batch", type=int, default=200, help="апдейтов за один update_interval")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Память и скорость антиспама на миллионе разных chat_id.
+
+    python bench/rate_limiter.py --chats 1000000 --per-sec 2000
+
+Время симулируется: per-sec новых чатов в секунду. Сравниваются старый словарь
+«последнее событие на чат» (никогда не чистится) и TokenBucketLimiter.
+"""
+import argparse
+import os
+import time
+import tracemalloc
+
+from fakes import install_fake_gspread
+
+
+def legacy(n, step):
+    last = {}
+    now = 0.0
+    for chat_id in range(n):
+        now += step
+        if now - last.get(chat_id, 0.0) >= 2.0:
+            last[chat_id] = now
+    return len(last)
+
+
+def bucketed(limiter, n, step, samples):
+    now = 0.0
+    for chat_id in range(n):
+        now += step
+        limiter.allow(chat_id, now)
+        if chat_id % (n // samples) == 0:
+            print(f"  after {chat_id:>8d} chats: keys={len(limiter.tat):6d} "
+                  f"traced={tracemalloc.get_traced_memory()[0] / 1e6:6.1f}MB")
+    return len(limiter.tat)
+
+
+def run(name, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    keys = fn()
+    dt = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:8s} keys={keys:8d} peak={peak / 1e6:7.1f}MB  {dt:.2f}s (под tracemalloc)")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--chats", type=int, default=1_000_000)
+    p.add_argument("--per-sec", type=float, default=2000.0)
+    args = p.parse_args()
+
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    install_fake_gspread()
+    import main
+
+    step = 1.0 / args.per_sec
+    rate, burst, g_rate, g_burst = main.RATE_LIMITS["flow"]
+    run("legacy", lambda: legacy(args.chats, step))
+    run("bucket", lambda: bucketed(main.TokenBucketLimiter(rate, int(burst)), args.chats, step, 5))
+
+    limiter = main.TokenBucketLimiter(rate, int(burst))
+    t0 = time.perf_counter()
+    now = 0.0
+    for chat_id in range(args.chats):
+        now += step
+        limiter.allow(chat_id, now)
+    dt = time.perf_counter() - t0
+    print(f"bucket throughput: {args.chats / dt / 1e6:.2f}M allow()/s ({dt / args.chats * 1e9:.0f} ns/op)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Всплеск исходящих сообщений против фейкового Bot API с лимитами Telegram.
+
+    python bench/send_scheduler.py --chats 300 --info 150 --admin 20
+
+Фейк отвечает 429 с retry_after сверх ~30 сообщений/с на бота и ~1/с (всплеск 3) на чат.
+direct    — бот без планировщика: 429 долетает до хендлера (пользователь видит «Ой!»);
+scheduled — через SendScheduler: полосы приоритета, бакеты и повтор по retry_after.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from fakes import FakeHTTPServer, FloodControl, bot_api_routes, install_fake_gspread, percentile, quiet_logs
+
+
+async def burst(bot, args, main):
+    """Шаги интервью (по 2 сообщения в чат), информационные команды и сводки админу — одновременно."""
+    latencies = {"flow": [], "info": [], "admin": []}
+    failed = {"flow": 0, "info": 0, "admin": 0}
+
+    async def send(lane, chat_id, text):
+        main.SEND_LANE.set(lane)  # как send_lane у хендлеров; у каждой задачи свой контекст
+        t0 = time.perf_counter()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            latencies[lane].append(time.perf_counter() - t0)
+        except Exception:
+            failed[lane] += 1
+
+    async def interview(chat_id):
+        await send("flow", chat_id, "Ок! Начинаем.")
+        await send("flow", chat_id, "💰 Сколько денег готов вложить?")
+
+    jobs = [interview(10_000 + i) for i in range(args.chats)]
+    jobs += [send("info", 20_000 + i, "Политика конфиденциальности ...") for i in range(args.info)]
+    jobs += [send("admin", 1, f"📥 Новые лиды: {i}") for i in range(args.admin)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*jobs)
+    return time.perf_counter() - t0, latencies, failed
+
+
+async def run_mode(name, args, main, rate_limiter):
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+
+    routes, stats = bot_api_routes(latency=args.latency, flood=FloodControl((30, 30), (1, 3)))
+    server = await FakeHTTPServer(routes).start()
+    bot = ExtBot("123456:bench", base_url=server.base_url + "/bot", rate_limiter=rate_limiter,
+                 request=HTTPXRequest(connection_pool_size=256))  # как в build_app
+    await bot.initialize()
+    try:
+        wall, latencies, failed = await burst(bot, args, main)
+    finally:
+        await bot.shutdown()
+        await server.stop()
+    print(f"{name}: wall={wall:.1f}s delivered={len(stats.sent)} got_429={stats.flooded}")
+    for lane, values in latencies.items():
+        print(f"  {lane:5s} ok={len(values):4d} failed={failed[lane]:4d} "
+              f"p50={percentile(values, 50):6.2f}s p99={percentile(values, 99):6.2f}s")
+
+
+async def run(args):
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    install_fake_gspread()
+    import main
+    quiet_logs()
+    main.log.setLevel("ERROR")
+
+    await run_mode("direct", args, main, None)
+    await run_mode("scheduled", args, main, main.SendScheduler())
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--chats", type=int, default=300, help="чатов в шаге интервью (по 2 сообщения)")
+    p.add_argument("--info", type=int, default=150, help="ответов на /privacy, /about ...")
+    p.add_argument("--admin", type=int, default=20, help="сообщений сводки админу")
+    p.add_argument("--latency", type=float, default=0.02)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
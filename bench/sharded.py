@@ -0,0 +1,85 @@
+"""Пропускная способность вебхука на N воркерах: всплеск /start от тысяч разных чатов.
+
+    python bench/sharded.py --workers 1 --updates 3000
+    python bench/sharded.py --workers 4 --updates 3000
+
+Запускает настоящий `python main.py` (WORKERS=N) против локального фейкового Bot API
+и шлёт апдейты в его вебхук. Google Sheets не настроены — бот работает без них.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from fakes import ROOT, FakeHTTPServer, bot_api_routes, make_update, wait_sent
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run(args):
+    routes, stats = bot_api_routes(latency=args.api_latency)
+    api = await FakeHTTPServer(routes).start()
+    port = free_port()
+    tmp = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN="123456:bench", TELEGRAM_API_URL=api.base_url,
+        WEBHOOK_BASE_URL=f"http://127.0.0.1:{port}", WEBHOOK_PATH="hook", PORT=str(port),
+        WORKERS=str(args.workers), BACKEND_RETRIES="1",
+        LEADS_DB_PATH=f"{tmp}/leads.db", PERSISTENCE_PATH=f"{tmp}/state.db", SHARED_STATE_PATH=f"{tmp}/shared.db",
+        RATE_LIMIT_FLOW="1000,1000,100000,100000", GOOGLE_CREDENTIALS_JSON="",
+        SEND_LIMIT_GLOBAL="100000,100000",  # меряем обработку, а не лимиты Telegram
+    )
+    env.pop("OPENAI_API_KEY", None)
+    env.pop("LOG_SHEET_ID", None)
+    proc = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while (stats.webhooks < 1 or stats.get_me < args.workers) and time.time() < deadline:
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(1.0)
+
+        url = f"http://127.0.0.1:{port}/hook"
+        sem = asyncio.Semaphore(args.concurrency)
+        async with httpx.AsyncClient(limits=httpx.Limits(max_connections=args.concurrency)) as http:
+            async def post(i):
+                async with sem:
+                    body = json.dumps(make_update(i + 1, 10_000 + i, "/start"))
+                    await http.post(url, content=body, headers={"Content-Type": "application/json"})
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(post(i) for i in range(args.updates)))
+            accepted = time.perf_counter() - t0
+            await wait_sent(stats, args.updates, timeout=300)
+            total = time.perf_counter() - t0
+        print(f"workers={args.workers} updates={args.updates} api_latency={args.api_latency * 1000:.0f}ms")
+        print(f"webhook accepted in {accepted:.2f}s; all replies in {total:.2f}s -> {args.updates / total:.0f} updates/s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+        await api.stop()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", type=int, default=2)
+    p.add_argument("--updates", type=int, default=3000)
+    p.add_argument("--concurrency", type=int, default=64)
+    p.add_argument("--api-latency", type=float, default=0.0)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Время холодного старта до ответа на первый апдейт (time-to-first-update).
+
+    python bench/startup.py --sheets-latency 1.5
+    python bench/startup.py --sheets-latency 1.5 --eager   # ждать Google до первого апдейта
+
+Google Sheets и Bot API заменены локальными фейками с задержками.
+"""
+import time
+
+T0 = time.perf_counter()
+
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import os  # noqa: E402
+
+from fakes import FakeHTTPServer, bot_api_routes, install_fake_gspread, make_update, wait_sent  # noqa: E402
+
+
+async def run(args):
+    routes, stats = bot_api_routes()
+    server = await FakeHTTPServer(routes).start()
+    os.environ["TELEGRAM_TOKEN"] = "123456:bench"
+    os.environ["TELEGRAM_API_URL"] = server.base_url
+    os.environ["LEADS_DB_PATH"] = ":memory:"
+    os.environ["LOG_SHEET_ID"] = "logs"
+    os.environ.pop("OPENAI_API_KEY", None)
+    install_fake_gspread(latency=args.sheets_latency, ws_latency=args.sheets_latency / 5)
+
+    t_import = time.perf_counter()
+    import main
+    from telegram import Update
+    t_imported = time.perf_counter()
+
+    app = main.build_app()
+    await app.initialize()
+    await app.post_init(app)
+    if args.eager:
+        await main._INIT_TASK
+    await app.start()
+    t_ready = time.perf_counter()
+
+    await app.process_update(Update.de_json(make_update(1, 42, "/start"), app.bot))
+    await wait_sent(stats, 1)
+    t_first = stats.sent[0][3]
+
+    await main._INIT_TASK
+    t_backends = time.perf_counter()
+
+    print(f"mode={'eager' if args.eager else 'lazy'} sheets_latency={args.sheets_latency}s")
+    print(f"import main:          {t_imported - t_import:.3f}s")
+    print(f"app ready:            {t_ready - T0:.3f}s")
+    print(f"time-to-first-update: {t_first - T0:.3f}s")
+    print(f"stores ready:         {t_backends - T0:.3f}s")
+
+    await app.stop()
+    await app.shutdown()
+    await app.post_shutdown(app)
+    await server.stop()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--sheets-latency", type=float, default=1.5)
+    p.add_argument("--eager", action="store_true")
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""/stats и выгрузка на больших объёмах.
+
+    python bench/stats.py --leads 200000 --events 500000
+
+Печатает время полного подсчёта, дочитывания хвоста после новых записей, число
+чтений листа и пиковую память (tracemalloc), а также скорость выгрузки CSV/JSONL.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from fakes import FakeWorksheet, install_fake_gspread
+
+EVENTS = ("start", "consent_accepted", "budget_provided", "skills_provided", "ideas_generated", "more")
+SKILLS = ("чат-боты", "ии", "дизайн", "excel", "таргет", "копирайтинг", "python", "монтаж")
+
+
+def event_rows(n, t0=0):
+    return [[f"2026-01-01T00:00:{(t0 + i) % 60:02d}", f"h{i % 5000}", EVENTS[min(i % 9, 5)]] for i in range(n)]
+
+
+def fill_leads(main, n):
+    rnd = random.Random(1)
+    for i in range(n):
+        skills = ", ".join(rnd.sample(SKILLS, 2) + [f"редкий навык {rnd.randrange(n)}"])
+        main.LEADS.append(["2026-01-01T00:00:00", f"h{i}", str(rnd.choice((0, 500, 5000, 50_000, 500_000))),
+                           skills, ">10 часов/нед", "идеи"])
+
+
+def measure(name, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:18s} {dt * 1000:9.1f} ms  peak={peak / 1e6:6.1f}MB")
+    return result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--leads", type=int, default=200_000)
+    p.add_argument("--events", type=int, default=500_000)
+    p.add_argument("--tail", type=int, default=1_000, help="новых записей между двумя /stats")
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:bench")
+    os.environ["LEADS_DB_PATH"] = os.path.join(tmp, "leads.db")
+    os.environ["LOG_SHEET_ID"] = "bench-log"
+    sheets = install_fake_gspread()
+    import main
+    ws = sheets["bench-log"] = FakeWorksheet([["timestamp", "chat_id_hash", "event"]] + event_rows(args.events))
+
+    fill_leads(main, args.leads)
+    stats = main.LeadStats()
+    snap = measure("full", lambda: asyncio.run(stats.get(main.LEADS, ws)))
+    print(f"  sheet calls={ws.calls} cells={ws.cells}")
+    measure("cached", lambda: asyncio.run(stats.get(main.LEADS, ws)))
+
+    fill_leads(main, args.tail)
+    ws.rows.extend(event_rows(args.tail, args.events))
+    stats.invalidate()
+    ws.calls = ws.cells = 0
+    snap = measure(f"tail +{args.tail}", lambda: asyncio.run(stats.get(main.LEADS, ws)))
+    print(f"  sheet calls={ws.calls} cells={ws.cells}")
+
+    del ws.rows[1:1 + args.tail]  # очистка по сроку сдвинула строки — пересчёт с нуля
+    stats.invalidate()
+    snap = measure("after prune", lambda: asyncio.run(stats.get(main.LEADS, ws)))
+    print(f"  leads={snap['leads']} events={snap['events']} conversion={snap['conversion']}")
+    print(f"  budgets={snap['budgets']}")
+    print(f"  top_skills={snap['top_skills'][:5]}")
+
+    for kind in ("leads", "events"):
+        for fmt in ("csv", "jsonl"):
+            out = os.path.join(tmp, f"{kind}.{fmt}")
+            measure(f"export {kind} {fmt}", lambda: main.export_main(["export", kind, "--format", fmt, "--out", out]))
+            print(f"  {os.path.getsize(out) / 1e6:.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,38 @@
 import os
+import re
 import json
+import bisect
+import asyncio
+import contextvars
+import functools
+import heapq
 import logging
 import hashlib
+import multiprocessing
+import queue
+import signal
+import sqlite3
 import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 import gspread
+import tornado.web
 from google.oauth2.service_account import Credentials
 
-from telegram import Update
+from telegram import Bot, Update
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, filters,
-    ContextTypes, ConversationHandler
+    ContextTypes, ConversationHandler,
+    BasePersistence, BaseRateLimiter, PersistenceInput, PicklePersistence,
 )
 
-from openai import OpenAI
-
 # ---------- Логи ----------
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -32,14 +48,141 @@ ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")  # строкой; напр., "615952
 RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
 HASH_SALT = os.getenv("HASH_SALT", "ai-idea-lab-salt")  # произвольная строка
 LOG_SHEET_ID = os.getenv("LOG_SHEET_ID")  # ID Google Sheet для логов (open_by_key)
-
-if not TELEGRAM_TOKEN:
-    raise RuntimeError("TELEGRAM_TOKEN не задан")
+LEADS_DB_PATH = os.getenv("LEADS_DB_PATH", "leads.db")  # локальная SQLite — основное хранилище лидов
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "6"))  # попыток подключения к Google Sheets
+BACKEND_RETRY_BASE_SEC = float(os.getenv("BACKEND_RETRY_BASE_SEC", "2"))
+WORKERS = int(os.getenv("WORKERS", "1"))  # >1 — webhook раздаёт апдейты по chat_id N процессам
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "shared_state.db")  # общее состояние воркеров
+SHARED_TOKEN_BATCH = int(os.getenv("SHARED_TOKEN_BATCH", "5"))  # токенов общего бакета за одну транзакцию
+SHARED_LOCK_TIMEOUT_SEC = float(os.getenv("SHARED_LOCK_TIMEOUT_SEC", "0.05"))  # ожидание блокировки SQLite
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))  # апдейтов разных чатов в обработке на процесс
+CHAT_QUEUE_MAX = int(os.getenv("CHAT_QUEUE_MAX", "10"))  # апдейтов одного чата в очереди, лишние отбрасываем
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # свой Bot API сервер, напр. http://localhost:8081
+SHEET_SYNC_SEC = float(os.getenv("SHEET_SYNC_SEC", "15"))  # как часто зеркалим лиды в Google Sheet
+RETENTION_JOB_SEC = float(os.getenv("RETENTION_JOB_SEC", str(6 * 3600)))  # период фоновой очистки
 
 if not OPENAI_API_KEY:
     log.warning("⚠️ OPENAI_API_KEY не задан — идеи генерироваться не будут.")
 
+# ---------- Метрики ----------
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # порт для /metrics (Prometheus); 0 — выключено
+
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Счётчики, гистограммы и gauge-колбэки в памяти; render() — текстовый формат Prometheus."""
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> число
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> fn() -> число
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def gauge(self, name: str, fn):
+        self.gauges[name] = fn
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Пишет длительность блока в гистограмму name_seconds, исключения — в name_errors_total."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - t0, **labels)
+
+    @staticmethod
+    def _labels(labels, extra=()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), hist in sorted(self.histograms.items()):
+            acc = 0
+            for le, n in zip(Histogram.BUCKETS + ("+Inf",), hist.counts):
+                acc += n
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', le)])} {acc}")
+            lines.append(f"{name}_sum{self._labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {hist.count}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                lines.append(f"{name} {fn():g}")
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def timed_handler(fn):
+    """Гистограмма латентности хендлера bot_handler_seconds{handler=...}."""
+    @functools.wraps(fn)
+    async def wrapper(update, context):
+        with METRICS.timer("bot_handler", handler=fn.__name__):
+            return await fn(update, context)
+    return wrapper
+
+async def _serve_metrics(reader, writer):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = METRICS.render().encode("utf-8")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, который меряет каждый вызов Bot API: bot_external_seconds{target="telegram"}."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        with METRICS.timer("bot_external", target="telegram", op=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, request_data, **kwargs)
+
 # ---------- Google Sheets ----------
+LEAD_HEADERS = ["timestamp", "chat_id_hash", "budget", "skills", "time_per_week", "ideas_text"]
+
+async def sheets_call(op: str, fn, *args):
+    """Блокирующий вызов gspread в потоке; время — в bot_external_seconds{target="sheets"}."""
+    with METRICS.timer("bot_external", target="sheets", op=op):
+        return await asyncio.to_thread(fn, *args)
+
 def _gc_client():
     creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
     if not creds_json:
@@ -61,10 +204,9 @@ def connect_sheet():
     log.info("✅ Подключено к Google Sheet: %s", SPREADSHEET_NAME)
     ws = sh.sheet1
     headers = ws.row_values(1)
-    wanted = ["timestamp", "chat_id_hash", "budget", "skills", "time_per_week", "ideas_text"]
-    if headers != wanted:
+    if headers != LEAD_HEADERS:
         ws.clear()
-        ws.append_row(wanted)
+        ws.append_row(LEAD_HEADERS)
     return ws
 
 def connect_log_sheet():
@@ -72,63 +214,794 @@ def connect_log_sheet():
     if not LOG_SHEET_ID:
         log.warning("⚠️ LOG_SHEET_ID не задан — логирование в Sheets выключено.")
         return None
-    try:
-        client = _gc_client()
-        sh = client.open_by_key(LOG_SHEET_ID)
-        ws = sh.sheet1  # используем первый лист
-        headers = ws.row_values(1)
-        wanted = ["timestamp", "chat_id_hash", "event"]
-        if headers != wanted:
-            ws.clear()
-            ws.append_row(wanted)
-        log.info("📝 Лог-таблица подключена")
-        return ws
-    except Exception as e:
-        log.warning("Не удалось подключить лог-таблицу: %s", e)
-        return None
+    client = _gc_client()
+    sh = client.open_by_key(LOG_SHEET_ID)
+    ws = sh.sheet1  # используем первый лист
+    headers = ws.row_values(1)
+    wanted = ["timestamp", "chat_id_hash", "event"]
+    if headers != wanted:
+        ws.clear()
+        ws.append_row(wanted)
+    log.info("📝 Лог-таблица подключена")
+    return ws
 
-SHEET = connect_sheet()
-LOGS_WS = connect_log_sheet()
+# Подключаются лениво в фоне из post_init (см. init_backends); до этого — None
+SHEET = None
+LOGS_WS = None
 
-def prune_old_rows(ws, retention_days: int = 30):
-    """Мягкая чистка: удаляем строки старше retention_days (если timestamp валиден)."""
+async def _with_retry(fn, what: str):
+    """Вызывает блокирующую fn в потоке с повторами и экспоненциальной паузой."""
+    delay = BACKEND_RETRY_BASE_SEC
+    for attempt in range(1, BACKEND_RETRIES + 1):
+        try:
+            return await sheets_call(fn.__name__, fn)
+        except Exception as e:
+            if attempt == BACKEND_RETRIES:
+                log.error("Не удалось подключить %s после %d попыток: %s", what, attempt, e)
+                return None
+            log.warning("Подключение %s: попытка %d не удалась (%s), повтор через %.0f с", what, attempt, e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+async def init_backends():
+    """Параллельно подключает таблицу лидов и лог-таблицу. Хендлеры работают и до готовности."""
+    global SHEET, LOGS_WS, _OPENAI_WARMUP
+    t0 = time.monotonic()
+    if OPENAI_API_KEY:
+        # прогреваем импорт openai в потоке, чтобы первая генерация не блокировала event loop
+        _OPENAI_WARMUP = asyncio.get_running_loop().run_in_executor(None, _warm_openai)
+    sheet, logs_ws = await asyncio.gather(
+        _with_retry(connect_sheet, "Google Sheet"),
+        _with_retry(connect_log_sheet, "лог-таблицу"),
+    )
+    LOGS_WS = logs_ws
+    if sheet is not None and WORKER_INDEX == 0:
+        # до публикации SHEET: sync_sheet_replica ещё не удаляет строки из-под чтения
+        try:
+            await backfill_leads(sheet)
+        except Exception as e:
+            log.warning("Не удалось перенести старые лиды из Google Sheet: %s", e)
+    SHEET = sheet
+    SHEET_INDEX.ws = sheet
+    log.info("🔌 Хранилища готовы за %.2f с", time.monotonic() - t0)
+
+def prune_old_rows(ws, retention_days: int = 30, index=None) -> int:
+    """Мягкая чистка: удаляем строки старше retention_days.
+
+    Строки дописываются по времени, поэтому устаревшие — это префикс листа:
+    читаем только колонку timestamp, ищем границу бинпоиском и удаляем одним запросом.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    if index is not None:  # чтение и удаление под блокировкой индекса — см. prune_prefix
+        return index.prune_prefix(cutoff)
+    expired = _expired_prefix(ws, cutoff)
+    if expired:
+        _batch_delete_rows(ws, expired)
+    return len(expired)
+
+def _expired_prefix(ws, cutoff: datetime) -> list:
+    """Номера строк старше cutoff (со 2-й подряд): одно чтение колонки timestamp и бинпоиск."""
+    values = ws.col_values(1)
+    end = bisect.bisect_left(values, cutoff, lo=1, key=_parse_ts)  # первая «свежая» строка (0-based)
+    return list(range(2, end + 1))
+
+def _parse_ts(value) -> datetime:
     try:
-        data = ws.get_all_values()
-        if len(data) <= 1:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return datetime.max  # невалидный timestamp не считаем устаревшим
+
+def _batch_delete_rows(ws, rows: list):
+    """Удаляет строки одним batch_update; подряд идущие — одним deleteDimension."""
+    ws.spreadsheet.batch_update({"requests": [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS", "startIndex": a - 1, "endIndex": b,
+        }}}
+        for a, b in reversed(_contiguous_ranges(rows))
+    ]})
+
+class SheetRowIndex:
+    """Индекс chat_id_hash -> номера строк листа, чтобы /erase не качал всю таблицу.
+
+    Строится лениво одним чтением колонки chat_id_hash, поддерживается при append/delete.
+    Перед удалением сверяем целевые ячейки; если лист правили в обход бота — перестраиваем.
+    """
+
+    def __init__(self, ws, col: int = 2):
+        self.ws = ws
+        self.col = col
+        self.rows = None  # {chat_id_hash: [номер строки, ...]} по возрастанию
+        self.last_row = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        values = self.ws.col_values(self.col)
+        rows = {}
+        for r, h in enumerate(values[1:], start=2):
+            if h:
+                rows.setdefault(h, []).append(r)
+        self.rows = rows
+        self.last_row = len(values)
+
+    def invalidate(self):
+        with self._lock:
+            self.rows = None
+
+    def clear(self, header: list):
+        """Очищает лист до заголовка. Под блокировкой: дозапись реплики или очистка по сроку
+        из другого потока иначе легли бы выше заголовка, а индекс считал бы лист пустым."""
+        with self._lock:
+            self.ws.clear()
+            self.ws.append_row(header)
+            self.rows = {}
+            self.last_row = 1
+
+    def append_rows(self, rows: list):
+        """append_rows в лист + обновление индекса по диапазону из ответа API."""
+        with self._lock:
+            resp = self.ws.append_rows(rows)
+            if self.rows is None:
+                return
+            m = re.search(r"![A-Z]+(\d+)", ((resp or {}).get("updates") or {}).get("updatedRange", ""))
+            first = int(m.group(1)) if m else None
+            if first != self.last_row + 1:
+                self.rows = None  # лист дописывали в обход индекса
+                return
+            for r, row in enumerate(rows, start=first):
+                self.rows.setdefault(row[self.col - 1], []).append(r)
+            self.last_row = first + len(rows) - 1
+
+    def _verify(self, chat_id_hash: str, ranges: list) -> bool:
+        got = self.ws.batch_get([f"{_col_letter(self.col)}{a}:{_col_letter(self.col)}{b}" for a, b in ranges])
+        for (a, b), vr in zip(ranges, got):
+            cells = [c[0] if c else "" for c in vr]
+            if len(cells) != b - a + 1 or any(c != chat_id_hash for c in cells):
+                return False
+        return True
+
+    def _delete_rows(self, rows: list):
+        _batch_delete_rows(self.ws, rows)
+        if self.rows is not None:
+            gone = sorted(rows)
+            gone_set = set(gone)
+            for h in list(self.rows):
+                if self.rows[h][-1] < gone[0]:
+                    continue
+                kept = [r - bisect.bisect_left(gone, r) for r in self.rows[h] if r not in gone_set]
+                if kept:
+                    self.rows[h] = kept
+                else:
+                    del self.rows[h]
+            self.last_row -= len(gone)
+
+    def prune_prefix(self, cutoff: datetime) -> int:
+        """Удаляет строки старше cutoff. Колонку читаем под той же блокировкой, что и
+        удаление: /erase между чтением и удалением сдвинул бы строки, и ушли бы свежие."""
+        with self._lock:
+            expired = _expired_prefix(self.ws, cutoff)
+            if expired:
+                self._delete_rows(expired)
+            return len(expired)
+
+    def delete_by_hash(self, chat_id_hash: str) -> int:
+        with self._lock:
+            if self.rows is None:
+                self._build()
+            rows = self.rows.get(chat_id_hash)
+            if not rows:
+                return 0
+            if not self._verify(chat_id_hash, _contiguous_ranges(rows)):
+                log.info("Индекс строк разошёлся с листом — перестраиваю")
+                self._build()
+                rows = self.rows.get(chat_id_hash)
+                if not rows:
+                    return 0
+            self._delete_rows(rows)
+            return len(rows)
+
+def _contiguous_ranges(rows: list) -> list:
+    """[2, 3, 4, 7] -> [(2, 4), (7, 7)]"""
+    ranges = []
+    for r in sorted(rows):
+        if ranges and r == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], r)
+        else:
+            ranges.append((r, r))
+    return ranges
+
+def _col_letter(col: int) -> str:
+    return gspread.utils.rowcol_to_a1(1, col).rstrip("0123456789")
+
+SHEET_INDEX = SheetRowIndex(None)  # ws проставит init_backends
+
+# ---------- Локальное хранилище лидов ----------
+class LeadStore(ABC):
+    """Хранилище лидов. Строка — значения в порядке LEAD_HEADERS.
+    Источник правды; Google Sheet — асинхронная реплика (см. sync_sheet_replica)."""
+
+    @abstractmethod
+    def append(self, row) -> int:
+        ...
+
+    @abstractmethod
+    def delete_by_hash(self, chat_id_hash: str) -> int:
+        ...
+
+    @abstractmethod
+    def prune_before(self, cutoff_iso: str) -> int:
+        ...
+
+    @abstractmethod
+    def clear(self):
+        ...
+
+    @abstractmethod
+    def pending_replica(self, limit: int) -> list:
+        """[(id, row), ...] — строки, ещё не отправленные в таблицу."""
+
+    @abstractmethod
+    def mark_replicated(self, ids):
+        ...
+
+    @abstractmethod
+    def pending_erasures(self) -> list:
+        """[(id, chat_id_hash), ...] — удаления, которые ещё надо повторить в таблице."""
+
+    @abstractmethod
+    def done_erasure(self, op_id: int):
+        ...
+
+    @abstractmethod
+    def page(self, after_id: int, limit: int, columns=tuple(LEAD_HEADERS)) -> list:
+        """[(id, значения columns), ...] с id > after_id по возрастанию — постраничное чтение."""
+
+    @abstractmethod
+    def count_upto(self, max_id: int) -> int:
+        """Сколько строк с id <= max_id осталось (меньше прочитанного — значит, были удаления)."""
+
+    @abstractmethod
+    def import_rows(self, rows) -> int:
+        """Строки, которые уже есть в таблице (до SQLite): вставляются как отзеркаленные.
+        Дубли (тот же chat_id_hash и timestamp) и чаты с невыполненным /erase пропускаются."""
+
+    @abstractmethod
+    def get_meta(self, key: str):
+        ...
+
+    @abstractmethod
+    def set_meta(self, key: str, value: str):
+        ...
+
+class SqliteLeadStore(LeadStore):
+    """SQLite в режиме WAL, индексы по chat_id_hash и timestamp.
+    Запросы занимают микросекунды, поэтому вызываются прямо из event loop."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS leads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        chat_id_hash TEXT NOT NULL,
+        budget TEXT,
+        skills TEXT,
+        time_per_week TEXT,
+        ideas_text TEXT,
+        synced INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS leads_chat_id_hash ON leads(chat_id_hash);
+    CREATE INDEX IF NOT EXISTS leads_timestamp ON leads(timestamp);
+    CREATE INDEX IF NOT EXISTS leads_unsynced ON leads(id) WHERE synced = 0;
+    CREATE TABLE IF NOT EXISTS sheet_erasures (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id_hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+
+    def append(self, row) -> int:
+        with self.db:
+            cur = self.db.execute(
+                "INSERT INTO leads (timestamp, chat_id_hash, budget, skills, time_per_week, ideas_text)"
+                " VALUES (?, ?, ?, ?, ?, ?)", list(row))
+        return cur.lastrowid
+
+    def delete_by_hash(self, chat_id_hash: str) -> int:
+        with self.db:
+            cur = self.db.execute("DELETE FROM leads WHERE chat_id_hash = ?", (chat_id_hash,))
+            # в таблице могут быть уже отзеркаленные (или старые) строки — удалим и там
+            self.db.execute("INSERT INTO sheet_erasures (chat_id_hash) VALUES (?)", (chat_id_hash,))
+        return cur.rowcount
+
+    def prune_before(self, cutoff_iso: str) -> int:
+        with self.db:
+            cur = self.db.execute("DELETE FROM leads WHERE timestamp < ?", (cutoff_iso,))
+        return cur.rowcount
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM leads")
+            self.db.execute("DELETE FROM sheet_erasures")
+
+    def pending_replica(self, limit: int) -> list:
+        cur = self.db.execute(
+            "SELECT id, timestamp, chat_id_hash, budget, skills, time_per_week, ideas_text"
+            " FROM leads WHERE synced = 0 ORDER BY id LIMIT ?", (limit,))
+        return [(r[0], list(r[1:])) for r in cur]
+
+    def mark_replicated(self, ids):
+        with self.db:
+            self.db.executemany("UPDATE leads SET synced = 1 WHERE id = ?", [(i,) for i in ids])
+
+    def pending_erasures(self) -> list:
+        return self.db.execute("SELECT id, chat_id_hash FROM sheet_erasures ORDER BY id").fetchall()
+
+    def done_erasure(self, op_id: int):
+        with self.db:
+            self.db.execute("DELETE FROM sheet_erasures WHERE id = ?", (op_id,))
+
+    def page(self, after_id: int, limit: int, columns=tuple(LEAD_HEADERS)) -> list:
+        assert set(columns) <= set(LEAD_HEADERS), columns  # имена колонок таблицы совпадают с LEAD_HEADERS
+        cols = ", ".join(columns)
+        cur = self.db.execute(f"SELECT id, {cols} FROM leads WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        return [(r[0], r[1:]) for r in cur]
+
+    def count_upto(self, max_id: int) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM leads WHERE id <= ?", (max_id,)).fetchone()[0]
+
+    def import_rows(self, rows) -> int:
+        erased = {h for (h,) in self.db.execute("SELECT chat_id_hash FROM sheet_erasures")}
+        imported = 0
+        with self.db:
+            for row in rows:
+                ts, chat_id_hash = row[0], row[1]
+                if not chat_id_hash or chat_id_hash in erased:
+                    continue
+                if self.db.execute("SELECT 1 FROM leads WHERE chat_id_hash = ? AND timestamp = ?",
+                                   (chat_id_hash, ts)).fetchone():
+                    continue
+                self.db.execute(
+                    "INSERT INTO leads (timestamp, chat_id_hash, budget, skills, time_per_week, ideas_text, synced)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 1)", list(row[:6]))
+                imported += 1
+        return imported
+
+    def get_meta(self, key: str):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self.db:
+            self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?)"
+                            " ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, value))
+
+LEADS: LeadStore = SqliteLeadStore(LEADS_DB_PATH)
+BACKFILL_PAGE_ROWS = int(os.getenv("BACKFILL_PAGE_ROWS", "5000"))
+
+async def backfill_leads(ws) -> int:
+    """Один раз: лиды, записанные в Google Sheet ещё до SQLite, переносим в LEADS —
+    иначе /erase, /stats и выгрузка их не видят. Лист читаем страницами по строкам."""
+    if LEADS.get_meta("sheet_backfill") == "done":
+        return 0
+    imported, start = 0, 2
+    while True:
+        end = start + BACKFILL_PAGE_ROWS - 1
+        values = await sheets_call("backfill", ws.get, f"A{start}:F{end}") or []
+        imported += LEADS.import_rows([(list(r) + [""] * 6)[:6] for r in values])
+        if len(values) < BACKFILL_PAGE_ROWS:
+            break
+        start = end + 1
+    LEADS.set_meta("sheet_backfill", "done")
+    log.info("📥 Перенесено лидов из Google Sheet в локальное хранилище: %d", imported)
+    return imported
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая очистка данных старше RETENTION_DAYS: локально, в таблице лидов и в лог-таблице."""
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    local = LEADS.prune_before(cutoff.isoformat())
+    sheets = [(SHEET, SHEET_INDEX), (LOGS_WS, None)]
+    removed = []
+    for ws, index in sheets:
+        if not ws:
+            continue
+        try:
+            removed.append(await sheets_call("prune", prune_old_rows, ws, RETENTION_DAYS, index))
+        except Exception as e:
+            log.warning("Не удалось выполнить очистку: %s", e)
+    STATS.invalidate()
+    log.info("🧹 Очистка завершена: локально %d, в таблицах %s строк", local, removed)
+
+async def sync_sheet_replica(context: ContextTypes.DEFAULT_TYPE):
+    """Фоновая задача: досылает новые лиды в Google Sheet и повторяет там /erase."""
+    if not SHEET:
+        return
+    if LEADS.get_meta("sheet_clear") == "pending":
+        try:
+            await clear_sheet_replica()
+        except Exception as e:
+            log.warning("Не удалось очистить Google Sheet: %s", e)
             return
-        cutoff = datetime.utcnow() - timedelta(days=retention_days)
-        to_delete = []
-        for idx, row in enumerate(data[1:], start=2):
-            ts = row[0].strip() if len(row) > 0 else ""
-            try:
-                dt = datetime.fromisoformat(ts)
-                if dt < cutoff:
-                    to_delete.append(idx)
-            except Exception:
-                continue
-        deleted = 0
-        for r in reversed(to_delete):
-            ws.delete_rows(r)
-            deleted += 1
-        log.info("🧹 Очистка завершена: удалено %d строк, осталось %d записей", deleted, len(ws.get_all_values()) - 1)
-    except Exception as e:
-        log.warning("Не удалось выполнить очистку: %s", e)
+    pending = LEADS.pending_replica(limit=500)
+    if pending:
+        try:
+            await sheets_call("append_leads", SHEET_INDEX.append_rows, [row for _, row in pending])
+            LEADS.mark_replicated([i for i, _ in pending])
+        except Exception as e:
+            log.warning("Не удалось отзеркалить лиды в Google Sheet (%d): %s", len(pending), e)
+            return
+    for op_id, chat_id_hash in LEADS.pending_erasures():
+        try:
+            deleted = await sheets_call("erase", SHEET_INDEX.delete_by_hash, chat_id_hash)
+            LEADS.done_erasure(op_id)
+            log.info("🗑 Удалено из Google Sheet: %d строк", deleted)
+        except Exception as e:
+            log.warning("Не удалось удалить строки в Google Sheet: %s", e)
+            return
+
+async def clear_sheet_replica():
+    """Повторяет /admin_clear в таблице лидов (SQLite к этому моменту уже очищена)."""
+    await sheets_call("clear", SHEET_INDEX.clear, LEAD_HEADERS)
+    LEADS.set_meta("sheet_clear", "done")
+    log.info("🧹 Google Sheet очищена")
+
+# ---------- Общее состояние воркеров ----------
+WORKER_INDEX = 0  # номер процесса-воркера; выставляется в _worker_main
+
+class SharedState(ABC):
+    """То, что должно быть общим для всех процессов: глобальные бакеты антиспама и кэш идей.
+    Состояние конкретного чата (его бакет, диалог) не здесь — чат всегда попадает в один воркер."""
+
+    @abstractmethod
+    def take_token(self, name: str, interval: float, tolerance: float) -> bool:
+        """Токен из общего бакета name (GCRA: interval — шаг, tolerance — запас всплеска).
+        Время реализация берёт сама: у процессов нет общего monotonic."""
+
+    @abstractmethod
+    def cache_get(self, key: str):
+        ...
+
+    @abstractmethod
+    def cache_put(self, key: str, text: str, ttl_sec: float):
+        ...
+
+    @abstractmethod
+    def cache_clear(self):
+        ...
+
+class LocalSharedState(SharedState):
+    """Один процесс: бакеты в памяти; кэш идей и так общий — второй уровень не нужен."""
+
+    def __init__(self):
+        self.tat = {}
+
+    def take_token(self, name: str, interval: float, tolerance: float) -> bool:
+        now = time.monotonic()
+        t = max(self.tat.get(name, now), now)
+        if t - now > tolerance:
+            return False
+        self.tat[name] = t + interval
+        return True
 
-prune_old_rows(SHEET, RETENTION_DAYS)
+    def cache_get(self, key: str):
+        return None
+
+    def cache_put(self, key: str, text: str, ttl_sec: float):
+        pass
+
+    def cache_clear(self):
+        pass
+
+class SqliteSharedState(SharedState):
+    """Общий для процессов SQLite-файл (WAL). Бакеты — по настенным часам, атомарно через BEGIN IMMEDIATE.
+
+    Токены берутся из базы пачками до batch штук и тратятся локально: транзакция — раз
+    на пачку, а не на каждое сообщение. Невыбранный остаток пачки сгорает через
+    batch × interval, чтобы не копить всплеск. Запросы синхронные, из event loop: при
+    конкуренции N воркеров за запись каждый ждёт блокировку до lock_timeout, и всё это
+    время его loop стоит, поэтому ожидание короткое, а не дождавшийся токен не получает.
+    """
+
+    def __init__(self, path: str, batch: int = SHARED_TOKEN_BATCH, lock_timeout: float = SHARED_LOCK_TIMEOUT_SEC):
+        self.db = sqlite3.connect(path, timeout=lock_timeout, isolation_level=None)
+        self.batch = batch
+        self.leases = {}  # name -> [осталось токенов, годны до (time.time())]
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tat REAL NOT NULL)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ideas_cache (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, text TEXT NOT NULL)"
+        )
+        # ключи старого формата — ответы открытым текстом (см. ideas_cache_key)
+        self.db.execute("DELETE FROM ideas_cache WHERE instr(key, char(31)) > 0")
+
+    def take_token(self, name: str, interval: float, tolerance: float) -> bool:
+        now = time.time()
+        lease = self.leases.get(name)
+        if lease is not None and lease[0] > 0 and now < lease[1]:
+            lease[0] -= 1
+            return True
+        try:
+            granted = self._grant(name, interval, tolerance, now)
+        except sqlite3.OperationalError:  # база занята дольше lock_timeout
+            METRICS.inc("bot_shared_state_busy_total")
+            return False
+        if not granted:
+            return False
+        self.leases[name] = [granted - 1, now + granted * interval]
+        return True
+
+    def _grant(self, name: str, interval: float, tolerance: float, now: float) -> int:
+        """Сколько токенов (до batch) удалось забрать из бакета одной транзакцией."""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute("SELECT tat FROM buckets WHERE name = ?", (name,)).fetchone()
+            t = max(row[0] if row else now, now)
+            if t - now > tolerance:
+                return 0
+            granted = min(self.batch, int((tolerance - (t - now)) / interval) + 1)
+            self.db.execute(
+                "INSERT INTO buckets (name, tat) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET tat = excluded.tat",
+                (name, t + granted * interval),
+            )
+            return granted
+        finally:
+            self.db.execute("COMMIT")
+
+    def cache_get(self, key: str):
+        """None и при занятой базе: кэш — не повод ронять генерацию, обойдёмся локальным LRU."""
+        try:
+            row = self.db.execute(
+                "SELECT text FROM ideas_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.OperationalError:
+            METRICS.inc("bot_shared_state_busy_total")
+            return None
+        return row[0] if row else None
+
+    def cache_put(self, key: str, text: str, ttl_sec: float):
+        now = time.time()
+        try:
+            self.db.execute(
+                "INSERT INTO ideas_cache (key, expires_at, text) VALUES (?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at, text = excluded.text",
+                (key, now + ttl_sec, text),
+            )
+            self.db.execute("DELETE FROM ideas_cache WHERE expires_at < ?", (now,))
+        except sqlite3.OperationalError:  # идеи остаются в локальном LRU этого воркера
+            METRICS.inc("bot_shared_state_busy_total")
+
+    def cache_clear(self):
+        # занятая база здесь — ошибка: /admin_clear сообщит о ней, и админ повторит команду
+        self.db.execute("DELETE FROM ideas_cache")
+
+SHARED: SharedState = SqliteSharedState(SHARED_STATE_PATH) if WORKERS > 1 else LocalSharedState()
 
 # ---------- OpenAI ----------
-client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-
-def generate_ideas(budget: str, skills: str, time_per_week: str) -> str:
-    fallback = (
-        "✅ Готово! Вот 3 идеи под твои условия:\n\n"
-        "1) Чат-ассистент для ниши, где ты шаришь (шаблоны + автозапуски).\n"
-        "2) Микросервис с ИИ-ответами на часто задаваемые вопросы (подписка).\n"
-        "3) Пакет шаблонов промптов/воркфлоу под конкретную боль (разовая продажа + апсейл).\n"
-    )
-    if not client:
-        return fallback
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))  # одновременных запросов к OpenAI
+OPENAI_TIMEOUT_SEC = float(os.getenv("OPENAI_TIMEOUT_SEC", "30"))  # с учётом ожидания в очереди
+
+client = None  # AsyncOpenAI создаётся при первой генерации
+_OPENAI_WARMUP = None  # future импорта openai в потоке (см. init_backends)
+
+def _openai_client():
+    global client
+    if client is None:
+        from openai import AsyncOpenAI  # импорт openai ~1 с — не тратим его на холодный старт
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+    return client
+
+def _warm_openai():
+    """Для потока: импорт openai и его ресурсов (client.chat тоже импортируется лениво, при первом обращении)."""
+    return _openai_client().chat.completions
+
+_OPENAI_SEM = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
+FALLBACK_IDEAS = (
+    "✅ Готово! Вот 3 идеи под твои условия:\n\n"
+    "1) Чат-ассистент для ниши, где ты шаришь (шаблоны + автозапуски).\n"
+    "2) Микросервис с ИИ-ответами на часто задаваемые вопросы (подписка).\n"
+    "3) Пакет шаблонов промптов/воркфлоу под конкретную боль (разовая продажа + апсейл).\n"
+)
 
+# ---------- Учёт токенов ----------
+OPENAI_CHEAP_MODEL = os.getenv("OPENAI_CHEAP_MODEL")  # куда уходим при превышении потолков; без него — запасные идеи
+OPENAI_MAX_TOKENS = int(os.getenv("OPENAI_MAX_TOKENS", "700"))  # верхняя граница ответа
+OPENAI_MIN_TOKENS = int(os.getenv("OPENAI_MIN_TOKENS", "250"))  # ниже адаптивный лимит не опускается
+OPENAI_ADAPTIVE_TOKENS = os.getenv("OPENAI_ADAPTIVE_TOKENS", "1") == "1"  # max_tokens по p99 длины ответов
+OPENAI_DAILY_BUDGET_USD = float(os.getenv("OPENAI_DAILY_BUDGET_USD", "0"))  # 0 — без потолка (на процесс)
+OPENAI_LATENCY_CEILING_SEC = float(os.getenv("OPENAI_LATENCY_CEILING_SEC", "0"))  # потолок p95 генерации, 0 — нет
+# цена за 1M токенов (вход, выход); свою модель можно задать через OPENAI_PRICE="вход,выход"
+OPENAI_PRICES = {"gpt-4o-mini": (0.15, 0.60), "gpt-4.1-mini": (0.40, 1.60), "gpt-4.1-nano": (0.10, 0.40)}
+if os.getenv("OPENAI_PRICE"):
+    OPENAI_PRICES[OPENAI_MODEL] = tuple(float(p) for p in os.getenv("OPENAI_PRICE").split(","))
+PROMPT_LIMITS = {"budget": 40, "skills": 300, "time_per_week": 40}  # символов на поле ввода
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+
+def clip_input(text: str, limit: int) -> str:
+    """Ответ пользователя для промпта: без управляющих символов и разметки, в одну строку, не длиннее limit."""
+    text = _CONTROL_CHARS.sub(" ", text or "").replace("`", "'")
+    text = " ".join(text.split())
+    if len(text) > limit:
+        METRICS.inc("bot_prompt_clipped_total")
+        text = text[:limit - 1].rstrip() + "…"
+    return text
+
+class TokenAccounting:
+    """Токены и время последних window генераций (из usage ответа) и траты за текущие сутки (UTC).
+
+    max_tokens() — адаптивный лимит ответа: p99 наблюдаемой длины с запасом headroom.
+    Ответ, упёршийся в лимит, попадает в выборку с длиной = лимиту, и лимит растёт обратно.
+    choose_model() — модель для следующего запроса: основная, дешёвая при превышении
+    дневного бюджета или потолка p95 латентности, или None (отдать запасные идеи). В режиме
+    None каждый probe_every-й запрос всё же идёт в основную модель, чтобы заметить, что стало лучше.
+    """
+
+    def __init__(self, window: int = 500, headroom: float = 1.25, min_samples: int = 20, probe_every: int = 20):
+        self.samples = deque(maxlen=window)  # (prompt_tokens, completion_tokens, seconds)
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self.day = None
+        self.spend_usd = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.requests = 0
+        self.truncated = 0
+        self.degraded = 0
+        self._sorted = {}  # поле -> отсортированная выборка (сбрасывается на record)
+
+    def _roll_day(self):
+        today = datetime.utcnow().date()
+        if today != self.day:
+            self.day = today
+            self.spend_usd = 0.0
+            self.prompt_tokens = self.completion_tokens = self.requests = self.truncated = 0
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int, seconds: float, truncated: bool = False):
+        self._roll_day()
+        price_in, price_out = OPENAI_PRICES.get(model, OPENAI_PRICES.get(OPENAI_MODEL, (0.0, 0.0)))
+        self.spend_usd += (prompt_tokens * price_in + completion_tokens * price_out) / 1e6
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.requests += 1
+        self.truncated += truncated
+        self.samples.append((prompt_tokens, completion_tokens, seconds))
+        self._sorted.clear()
+        METRICS.inc("bot_openai_tokens_total", prompt_tokens, kind="prompt", model=model)
+        METRICS.inc("bot_openai_tokens_total", completion_tokens, kind="completion", model=model)
+        if truncated:
+            METRICS.inc("bot_openai_truncated_total", model=model)
+
+    def percentile(self, field: int, p: float) -> float:
+        """field: 0 — prompt, 1 — completion, 2 — секунды."""
+        values = self._sorted.get(field)
+        if values is None:
+            values = self._sorted[field] = sorted(s[field] for s in self.samples)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def max_tokens(self) -> int:
+        if not OPENAI_ADAPTIVE_TOKENS or len(self.samples) < self.min_samples:
+            return OPENAI_MAX_TOKENS
+        limit = int(self.percentile(1, 99) * self.headroom)
+        return max(OPENAI_MIN_TOKENS, min(OPENAI_MAX_TOKENS, limit))
+
+    def over_ceiling(self):
+        """Какой потолок превышен: "budget", "latency" или None."""
+        self._roll_day()
+        if OPENAI_DAILY_BUDGET_USD and self.spend_usd >= OPENAI_DAILY_BUDGET_USD:
+            return "budget"
+        if (OPENAI_LATENCY_CEILING_SEC and len(self.samples) >= self.min_samples
+                and self.percentile(2, 95) > OPENAI_LATENCY_CEILING_SEC):
+            return "latency"
+        return None
+
+    def choose_model(self):
+        reason = self.over_ceiling()
+        if reason is None:
+            return OPENAI_MODEL
+        self.degraded += 1
+        METRICS.inc("bot_openai_degraded_total", reason=reason)
+        if OPENAI_CHEAP_MODEL:
+            return OPENAI_CHEAP_MODEL
+        if reason == "latency" and self.degraded % self.probe_every == 0:
+            return OPENAI_MODEL
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests, "spend_usd": round(self.spend_usd, 4),
+            "prompt_p50": self.percentile(0, 50), "completion_p50": self.percentile(1, 50),
+            "completion_p99": self.percentile(1, 99), "latency_p95": round(self.percentile(2, 95), 3),
+            "max_tokens": self.max_tokens(), "truncated": self.truncated,
+        }
+
+TOKENS = TokenAccounting()
+METRICS.gauge("bot_openai_spend_usd_today", lambda: TOKENS.spend_usd)
+METRICS.gauge("bot_openai_max_tokens", TOKENS.max_tokens)
+METRICS.gauge("bot_openai_completion_tokens_p50", lambda: TOKENS.percentile(1, 50))
+METRICS.gauge("bot_openai_completion_tokens_p99", lambda: TOKENS.percentile(1, 99))
+
+async def _complete_ideas(prompt: str, model: str, on_delta=None) -> str:
+    """Если передан on_delta — стримим ответ и вызываем on_delta(накопленный текст) на каждый кусок."""
+    max_tokens = TOKENS.max_tokens()
+    if _OPENAI_WARMUP is not None and not _OPENAI_WARMUP.done():
+        # импорт ещё идёт в потоке: синхронный импорт здесь встал бы на его блокировке
+        try:
+            await asyncio.shield(_OPENAI_WARMUP)
+        except Exception:
+            pass
+    async with _OPENAI_SEM:
+        with METRICS.timer("bot_external", target="openai", op="completion"):
+            t0 = time.perf_counter()
+            resp = await _openai_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "Ты помогаешь запускать простые бизнесы на ИИ, отвечай кратко и практично."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=max_tokens,
+                stream=on_delta is not None,
+                **({"stream_options": {"include_usage": True}} if on_delta is not None else {}),
+            )
+            if on_delta is None:
+                text = resp.choices[0].message.content.strip()
+                usage, finish = resp.usage, resp.choices[0].finish_reason
+            else:
+                parts, usage, finish = [], None, None
+                async for chunk in resp:
+                    if chunk.usage is not None:  # последний чанк: choices пуст, только usage
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    finish = chunk.choices[0].finish_reason or finish
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if not parts:
+                            METRICS.observe("bot_external_seconds", time.perf_counter() - t0, target="openai", op="first_token")
+                        parts.append(delta)
+                        on_delta("".join(parts))
+                text = "".join(parts).strip()
+            if usage is not None:
+                TOKENS.record(model, usage.prompt_tokens, usage.completion_tokens,
+                              time.perf_counter() - t0, truncated=finish == "length")
+    return text
+
+async def _generate(prompt: str, on_delta=None):
+    """Текст идей или None при ошибке/таймауте/превышении потолков (None не кэшируется)."""
+    model = TOKENS.choose_model()
+    if model is None:
+        METRICS.inc("bot_fallbacks_total", reason="ceiling")
+        return None
+    try:
+        return await asyncio.wait_for(_complete_ideas(prompt, model, on_delta), timeout=OPENAI_TIMEOUT_SEC)
+    except asyncio.TimeoutError:
+        log.warning("OpenAI: таймаут %.1f с — отдаю запасные идеи", OPENAI_TIMEOUT_SEC)
+        METRICS.inc("bot_fallbacks_total", reason="timeout")
+    except Exception as e:
+        log.error("OpenAI error: %s", e)
+        METRICS.inc("bot_fallbacks_total", reason="error")
+    return None
+
+async def generate_ideas(budget: str, skills: str, time_per_week: str, on_delta=None) -> str:
+    """Не блокирует event loop; повторы одинаковых условий отдаются из IDEAS_CACHE.
+    on_delta получает частичный текст по мере генерации (при попадании в кэш не вызывается).
+    При ошибке, таймауте или превышении дневных потолков возвращает FALLBACK_IDEAS."""
+    if not OPENAI_API_KEY:
+        METRICS.inc("bot_fallbacks_total", reason="no_api_key")
+        return FALLBACK_IDEAS
+
+    budget = clip_input(budget, PROMPT_LIMITS["budget"])
+    skills = clip_input(skills, PROMPT_LIMITS["skills"])
+    time_per_week = clip_input(time_per_week, PROMPT_LIMITS["time_per_week"])
     prompt = f"""
 Ты — продуктовый консультант. Сгенерируй три реалистичные идеи микробизнеса на базе ИИ-чатов.
 Условия:
@@ -143,45 +1016,754 @@ def generate_ideas(budget: str, skills: str, time_per_week: str) -> str:
 — Как монетизировать (1–2 варианта)
 Сделай лаконично и по делу.
 """
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Ты помогаешь запускать простые бизнесы на ИИ, отвечай кратко и практично."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=700,
-        )
-        return resp.choices[0].message.content.strip()
-    except Exception as e:
-        log.error("OpenAI error: %s", e)
-        return fallback
+    key = ideas_cache_key(budget, skills, time_per_week)
+    ideas = await IDEAS_CACHE.get_or_create(key, lambda: _generate(prompt, on_delta))
+    return ideas or FALLBACK_IDEAS
+
+# ---------- Кэш идей ----------
+IDEAS_CACHE_SIZE = int(os.getenv("IDEAS_CACHE_SIZE", "512"))
+IDEAS_CACHE_TTL_SEC = float(os.getenv("IDEAS_CACHE_TTL_SEC", str(24 * 3600)))
+IDEAS_CACHE_PATH = os.getenv("IDEAS_CACHE_PATH")  # JSON-файл; если задан — кэш переживает рестарт
+
+_NUM_SUFFIX = {"k": 1000, "к": 1000, "тыс": 1000, "m": 1_000_000, "м": 1_000_000, "млн": 1_000_000}
+
+def _norm_text(s: str) -> str:
+    s = " ".join((s or "").lower().replace("ё", "е").split())
+    return re.sub(r"\s*([<>/+~≈–-])\s*", r"\1", s)
+
+def _norm_numbers(s: str) -> str:
+    """«100 000», «100.000», «100к», «0,1 млн» -> «100000»."""
+    s = re.sub(r"(?<=\d)[\s.,'](?=\d{3}(?!\d))", "", _norm_text(s))
+
+    def expand(m):
+        value = float(m.group(1).replace(",", "."))
+        value *= _NUM_SUFFIX[m.group(2).rstrip(".")]
+        return f"{value:g}" if value < 1e15 else m.group(0)
+
+    s = re.sub(r"(\d+(?:[.,]\d+)?)\s*(k|к|тыс\.?|m|м|млн)(?![a-zа-я])", expand, s)
+    return s
+
+def split_skills(text: str) -> list:
+    """Навыки без регистра, дублей и порядка — для ключа кэша и статистики."""
+    parts = re.split(r"\s*(?:[,;/\n]|\bи\b)\s*", _norm_text(text).replace("-", " "))
+    return sorted({p.strip() for p in parts if p.strip()})
+
+def ideas_cache_key(budget: str, skills: str, time_per_week: str) -> str:
+    """sha256 нормализованных ответов: кэш лежит на диске и в общей базе сутки, а обещание
+    удаления данных (PRIVACY_TEXT) не должно зависеть от его TTL — текста ответов в ключе нет."""
+    skills_key = ", ".join(split_skills(skills))
+    normalized = "\x1f".join((_norm_numbers(budget), skills_key, _norm_numbers(time_per_week)))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class IdeaCache:
+    """LRU + TTL кэш готовых идей с объединением одинаковых запросов «в полёте».
+
+    Счётчики hits/misses/evictions/shared и saved_sec — сколько секунд генерации сэкономлено.
+    """
+
+    ABANDONED = object()  # результат «в полёте» для ожидающих, если генерацию отменили
+
+    def __init__(self, max_size: int, ttl_sec: float, path: str = None):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.path = path
+        self.data = OrderedDict()  # key -> (expires_at, text)
+        self.inflight = {}  # key -> Future
+        self.hits = self.misses = self.evictions = self.shared = 0
+        self.saved_sec = 0.0
+        self._gen_sec = 0.0  # суммарное время промахов — для средней стоимости генерации
+        self._dirty = False
+
+    def get(self, key: str):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        if item[0] < time.time():
+            del self.data[key]
+            self._dirty = True
+            return None
+        self.data.move_to_end(key)
+        return item[1]
+
+    def put(self, key: str, text: str, share: bool = True):
+        if share:
+            SHARED.cache_put(key, text, self.ttl_sec)
+        self.data[key] = (time.time() + self.ttl_sec, text)
+        self.data.move_to_end(key)
+        while len(self.data) > self.max_size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        self._dirty = True
+
+    def _avg_gen_sec(self) -> float:
+        return self._gen_sec / self.misses if self.misses else 0.0
+
+    async def get_or_create(self, key: str, factory):
+        """factory() -> текст или None. Параллельные одинаковые запросы ждут один вызов;
+        если его отменили (например, спекулятивную генерацию), ожидающий запускает свой."""
+        while True:
+            cached = self.get(key)
+            if cached is None:
+                cached = SHARED.cache_get(key)  # сгенерировал другой воркер
+                if cached is not None:
+                    self.put(key, cached, share=False)
+            if cached is not None:
+                self.hits += 1
+                self.saved_sec += self._avg_gen_sec()
+                return cached
+            fut = self.inflight.get(key)
+            if fut is None:
+                break
+            self.shared += 1
+            text = await asyncio.shield(fut)
+            if text is not self.ABANDONED:
+                return text
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[key] = fut
+        t0 = time.monotonic()
+        text = self.ABANDONED
+        try:
+            text = await factory()
+            if text is not None:
+                self.put(key, text)
+            return text
+        finally:
+            self._gen_sec += time.monotonic() - t0
+            self.inflight.pop(key, None)
+            fut.set_result(text)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.data), "hits": self.hits, "misses": self.misses, "shared": self.shared,
+            "evictions": self.evictions, "saved_sec": round(self.saved_sec, 1),
+        }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                items = json.load(f)
+            now = time.time()
+            for key, expires_at, text in items[-self.max_size:]:
+                if expires_at > now and "\x1f" not in key:  # старый формат — ответы открытым текстом
+                    self.data[key] = (expires_at, text)
+                else:
+                    self._dirty = True
+            log.info("💾 Кэш идей загружен: %d записей", len(self.data))
+        except Exception as e:
+            log.warning("Не удалось загрузить кэш идей: %s", e)
+
+    def clear(self):
+        """Всё, включая файл и общий кэш воркеров (/admin_clear)."""
+        self.data.clear()
+        self._dirty = True
+        self.save()
+        SHARED.cache_clear()
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        try:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump([[k, exp, text] for k, (exp, text) in self.data.items()], f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self._dirty = False
+        except Exception as e:
+            log.warning("Не удалось сохранить кэш идей: %s", e)
+
+IDEAS_CACHE = IdeaCache(IDEAS_CACHE_SIZE, IDEAS_CACHE_TTL_SEC, IDEAS_CACHE_PATH)
+IDEAS_CACHE.load()
+for _name in ("hits", "misses", "shared", "evictions", "saved_sec"):
+    METRICS.gauge(f"bot_ideas_cache_{_name}", lambda n=_name: getattr(IDEAS_CACHE, n))
+METRICS.gauge("bot_ideas_cache_size", lambda: len(IDEAS_CACHE.data))
+
+async def save_ideas_cache(context: ContextTypes.DEFAULT_TYPE):
+    IDEAS_CACHE.save()
+    log.info("💾 Кэш идей: %s", IDEAS_CACHE.stats())
 
 # ---------- Безопасные утилиты ----------
+CHAT_HASH_CACHE_SIZE = int(os.getenv("CHAT_HASH_CACHE_SIZE", "65536"))  # чатов в LRU хэшей
+
+_SALT_DIGEST = hashlib.sha256(f"{HASH_SALT}:".encode("utf-8"))  # соль уже «внутри», дальше только copy()
+
+@functools.lru_cache(maxsize=CHAT_HASH_CACHE_SIZE)
 def hash_chat_id(chat_id: int) -> str:
-    s = f"{HASH_SALT}:{chat_id}".encode("utf-8")
-    return hashlib.sha256(s).hexdigest()
+    """sha256(f"{HASH_SALT}:{chat_id}") — тот же хэш, что и раньше, но соль не хэшируется заново."""
+    digest = _SALT_DIGEST.copy()
+    digest.update(str(chat_id).encode("ascii"))
+    return digest.hexdigest()
+
+class ChatContext:
+    """Чат текущего апдейта: создаётся один раз в начале хендлера. Хэш и время события
+    считаются при первом обращении и дальше переиспользуются (rate_ok, log_event, запись лида)."""
+
+    __slots__ = ("id", "_hash", "_ts")
+
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self._hash = None
+        self._ts = None
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = hash_chat_id(self.id)
+        return self._hash
+
+    @property
+    def ts(self) -> str:
+        if self._ts is None:
+            self._ts = datetime.utcnow().isoformat()
+        return self._ts
+
+def chat_context(update: Update) -> ChatContext:
+    return ChatContext(update.effective_chat.id)
 
-def log_event(chat_id: int, event: str):
-    """Логируем минимум: timestamp, chat_id_hash, event."""
-    if not LOGS_WS:
+# ---------- Пакетная запись логов ----------
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "5000"))  # событий в памяти, дальше — отбрасываем
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_SEC = float(os.getenv("LOG_FLUSH_SEC", "5"))
+LOG_BACKOFF_MAX_SEC = float(os.getenv("LOG_BACKOFF_MAX_SEC", "120"))  # потолок паузы после неудачных записей
+
+class EventRecord:
+    """Событие в очереди логов: три поля в __slots__, без __dict__ (меньше и дешевле списка).
+    В таблицу пачка уходит кортежами — см. as_row."""
+
+    __slots__ = ("ts", "chat_hash", "event")
+
+    def __init__(self, ts: str, chat_hash: str, event: str):
+        self.ts = ts
+        self.chat_hash = chat_hash
+        self.event = event
+
+    def as_row(self) -> tuple:
+        return self.ts, self.chat_hash, self.event
+
+class EventLogPipeline:
+    """Буфер событий в памяти; фоновая задача пишет их в лог-таблицу одним append_rows
+    по заполнению пачки (batch_size) или по таймеру (flush_sec).
+
+    После неудачной записи следующая попытка — не раньше чем через backoff (flush_sec,
+    дальше вдвое, до LOG_BACKOFF_MAX_SEC), и полная пачка на это время сброс не будит:
+    иначе при сбое или 429 Sheets каждое новое событие тратило бы ещё один запрос квоты."""
+
+    def __init__(self, max_size: int, batch_size: int, flush_sec: float):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self.buf = deque()
+        self.dropped = 0
+        self.written = 0
+        self.backoff = 0.0  # текущая пауза после сбоя; 0 — пишем как обычно
+        self._retry_at = 0.0
+        self._full = asyncio.Event()
+        self._task = None
+        self._stopping = False
+
+    def put(self, record: EventRecord) -> bool:
+        """Не ждёт сеть. При переполнении отбрасывает событие и считает его в dropped."""
+        if len(self.buf) >= self.max_size:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                log.warning("Очередь логов переполнена — отброшено событий: %d", self.dropped)
+            return False
+        self.buf.append(record)
+        if len(self.buf) >= self.batch_size and not self.backoff:
+            self._full.set()
+        return True
+
+    def _take(self) -> list:
+        n = min(self.batch_size, len(self.buf))
+        return [self.buf.popleft() for _ in range(n)]
+
+    async def _write(self, batch: list):
+        ws = LOGS_WS
+        if not batch:
+            return
+        try:
+            await sheets_call("append_events", ws.append_rows, [r.as_row() for r in batch])
+            self.written += len(batch)
+            self.backoff = 0.0
+            STATS.invalidate()
+        except Exception as e:
+            self.backoff = min(LOG_BACKOFF_MAX_SEC, self.backoff * 2 or self.flush_sec)
+            self._retry_at = time.monotonic() + self.backoff
+            self._full.clear()
+            log.warning("Не удалось записать пачку логов (%d): %s — повтор через %.0f с", len(batch), e, self.backoff)
+            # вернём в начало очереди, сколько влезет — повторим на следующем сбросе
+            room = max(0, self.max_size - len(self.buf))
+            self.buf.extendleft(reversed(batch[:room]))
+            self.dropped += len(batch) - room
+
+    async def flush(self):
+        if not LOGS_WS:  # лог-таблица ещё подключается — копим в буфере
+            return
+        while self.buf:
+            before = len(self.buf)
+            await self._write(self._take())
+            if len(self.buf) >= before:  # запись не удалась — не крутимся вхолостую
+                break
+
+    async def run(self):
+        while not self._stopping:
+            timeout = self.flush_sec
+            if self.backoff:
+                timeout = max(0.0, self._retry_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if self.backoff and time.monotonic() < self._retry_at and not self._stopping:
+                continue
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self.buf or self.dropped:
+            log.warning("Логи: не записано %d, отброшено %d событий", len(self.buf), self.dropped)
+
+EVENT_LOG = EventLogPipeline(LOG_QUEUE_MAX, LOG_BATCH_SIZE, LOG_FLUSH_SEC)
+METRICS.gauge("bot_event_log_queued", lambda: len(EVENT_LOG.buf))
+METRICS.gauge("bot_event_log_dropped", lambda: EVENT_LOG.dropped)
+
+def log_event(chat: ChatContext, event: str):
+    """Логируем минимум: timestamp, chat_id_hash, event. Только кладём в очередь — сеть не ждём."""
+    if not LOG_SHEET_ID:
         return
+    EVENT_LOG.put(EventRecord(chat.ts, chat.hash, event))
+
+# ---------- Статистика и выгрузка ----------
+STATS_PAGE_ROWS = int(os.getenv("STATS_PAGE_ROWS", "5000"))  # строк за одно чтение (SQLite / диапазон листа)
+STATS_TRACK_SKILLS = int(os.getenv("STATS_TRACK_SKILLS", "2000"))  # счётчиков навыков в памяти (top-k)
+STATS_CACHE_SEC = float(os.getenv("STATS_CACHE_SEC", "60"))  # без новых записей отдаём готовый ответ
+FUNNEL_EVENTS = ("start", "consent_accepted", "budget_provided", "skills_provided", "ideas_generated")
+BUDGET_BUCKETS = ((0, "0"), (1000, "до 1k"), (10_000, "1k–10k"), (100_000, "10k–100k"), (float("inf"), "100k+"))
+BUDGET_LABELS = [label for _, label in BUDGET_BUCKETS] + ["?"]
+
+def budget_bucket(text: str) -> str:
+    m = re.search(r"\d+(?:\.\d+)?", _norm_numbers(text))
+    if not m:
+        return "?"
+    value = float(m.group(0))
+    for limit, label in BUDGET_BUCKETS:
+        if value <= limit:
+            return label
+
+class LeadStats:
+    """Агрегаты по лидам (SQLite) и событиям (лог-таблица), посчитанные инкрементально.
+
+    Помним, до какого id лидов и до какой строки лога дочитали, и при обновлении читаем
+    только хвост страницами по STATS_PAGE_ROWS — из листа берём одну колонку event.
+    Удаления (/erase, очистка по сроку) сдвигают данные: проверяем, что число лидов до
+    отметки и строка лога на отметке не изменились, иначе считаем заново. Навыки — приближённый top-k:
+    держим не больше 2×track счётчиков, при переполнении оставляем track самых частых,
+    так что память ограничена при любом числе строк.
+    """
+
+    def __init__(self, track: int = STATS_TRACK_SKILLS):
+        self.track = track
+        self.dirty = True
+        self.updated = 0.0
+        self.cached = None
+        self.lock = asyncio.Lock()  # два /stats разом не должны дочитывать хвост одновременно
+        self.reset_leads()
+        self.reset_events()
+
+    def reset_leads(self):
+        self.lead_mark = 0
+        self.leads = 0
+        self.budgets = {}
+        self.skills = {}
+
+    def reset_events(self):
+        self.event_row = 1  # последняя прочитанная строка листа (1 — заголовок)
+        self.event_last = None  # [timestamp, chat_id_hash] этой строки
+        self.events = {}
+
+    def invalidate(self):
+        self.dirty = True
+
+    def _count_skill(self, skill: str):
+        skills = self.skills
+        skills[skill] = skills.get(skill, 0) + 1
+        if len(skills) > 2 * self.track:  # редкие навыки отбрасываем пачкой — O(1) в среднем
+            self.skills = dict(heapq.nlargest(self.track, skills.items(), key=lambda kv: kv[1]))
+
+    async def refresh_leads(self, store: LeadStore):
+        if self.lead_mark and store.count_upto(self.lead_mark) != self.leads:
+            self.reset_leads()
+        while True:
+            rows = store.page(self.lead_mark, STATS_PAGE_ROWS, ("budget", "skills"))
+            for _, (budget, skills) in rows:
+                label = budget_bucket(budget)
+                self.budgets[label] = self.budgets.get(label, 0) + 1
+                for skill in split_skills(skills):
+                    self._count_skill(skill)
+            if rows:
+                self.lead_mark = rows[-1][0]
+                self.leads += len(rows)
+            if len(rows) < STATS_PAGE_ROWS:
+                return
+            await asyncio.sleep(0)  # страница за тик — не держим event loop
+
+    def refresh_events(self, ws):
+        """Блокирующая: только для потока (sheets_call) или CLI."""
+        if self.event_last is not None:
+            at = ws.get(f"A{self.event_row}:B{self.event_row}")
+            if not at or list(at[0][:2]) != self.event_last:
+                self.reset_events()
+        for first, values in iter_sheet_column(ws, "C", self.event_row + 1):
+            for value in values:
+                event = (value[0] if value else "").split(":", 1)[0]
+                self.events[event] = self.events.get(event, 0) + 1
+            self.event_row = first + len(values) - 1
+        if self.event_row > 1:
+            at = ws.get(f"A{self.event_row}:B{self.event_row}")
+            self.event_last = list(at[0][:2]) if at else None
+
+    def snapshot(self) -> dict:
+        started = self.events.get("start", 0)
+        funnel = {e: self.events.get(e, 0) for e in FUNNEL_EVENTS}
+        return {
+            "leads": self.leads,
+            "events": self.event_row - 1,
+            "funnel": funnel,
+            "conversion": round(funnel["ideas_generated"] / started, 4) if started else None,
+            "budgets": {label: self.budgets.get(label, 0) for label in BUDGET_LABELS},
+            "top_skills": sorted(self.skills.items(), key=lambda kv: -kv[1])[:10],
+        }
+
+    async def get(self, store: LeadStore, ws) -> dict:
+        """Снимок с кэшем: пока не было новых записей и не прошло STATS_CACHE_SEC — без чтений."""
+        if self.fresh():
+            return self.cached
+        async with self.lock:
+            if self.fresh():  # пока ждали, снимок обновил другой вызов
+                return self.cached
+            self.dirty = False  # записи во время чтения снова выставят флаг
+            await self.refresh_leads(store)
+            if ws is not None:
+                await sheets_call("stats_events", self.refresh_events, ws)
+            self.updated = time.monotonic()
+            self.cached = self.snapshot()
+            return self.cached
+
+    def fresh(self) -> bool:
+        return bool(self.cached) and not self.dirty and time.monotonic() - self.updated < STATS_CACHE_SEC
+
+def iter_sheet_column(ws, col: str, start_row: int, page: int = STATS_PAGE_ROWS, width: str = None):
+    """Читает колонку (или колонки col:width) страницами: (первая строка, [значения])
+    до первой неполной страницы. Весь лист в память не попадает."""
+    last = width or col
+    while True:
+        values = ws.get(f"{col}{start_row}:{last}{start_row + page - 1}")
+        values = list(values or [])
+        if values:
+            yield start_row, values
+        if len(values) < page:
+            return
+        start_row += page
+
+STATS = LeadStats()
+
+def format_stats(snap: dict) -> str:
+    funnel = " → ".join(f"{e} {n}" for e, n in snap["funnel"].items())
+    conv = f"{snap['conversion']:.1%}" if snap["conversion"] is not None else "—"
+    budgets = ", ".join(f"{k}: {v}" for k, v in snap["budgets"].items() if v)
+    skills = ", ".join(f"{k} ({v})" for k, v in snap["top_skills"])
+    return (
+        f"📊 Лидов: {snap['leads']}, событий в логе: {snap['events']}\n\n"
+        f"Воронка: {funnel}\n"
+        f"Конверсия start → ideas_generated: {conv}\n\n"
+        f"Бюджеты: {budgets or '—'}\n\n"
+        f"Топ навыков: {skills or '—'}"
+    )
+
+def export_rows(kind: str):
+    """Строки для выгрузки постранично: leads — из SQLite, events — из лог-таблицы."""
+    if kind == "leads":
+        after = 0
+        while True:
+            rows = LEADS.page(after, STATS_PAGE_ROWS)
+            for _, row in rows:
+                yield row
+            if len(rows) < STATS_PAGE_ROWS:
+                return
+            after = rows[-1][0]
+    ws = connect_log_sheet()
+    if ws is None:
+        raise RuntimeError("LOG_SHEET_ID не задан")
+    for _, values in iter_sheet_column(ws, "A", 2, width="C"):
+        for row in values:
+            yield (list(row) + ["", "", ""])[:3]
+
+def export_main(argv: list) -> int:
+    """python main.py export leads|events [--format csv|jsonl] [--out файл]
+    python main.py stats — агрегаты одной строкой JSON."""
+    import argparse
+    import csv
+    import sys
+
+    parser = argparse.ArgumentParser(prog="main.py")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    exp = sub.add_parser("export")
+    exp.add_argument("kind", choices=("leads", "events"))
+    exp.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    exp.add_argument("--out")
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "stats":
+        ws = connect_log_sheet()
+        asyncio.run(STATS.refresh_leads(LEADS))
+        if ws is not None:
+            STATS.refresh_events(ws)
+        print(json.dumps(STATS.snapshot(), ensure_ascii=False))
+        return 0
+
+    header = LEAD_HEADERS if args.kind == "leads" else ["timestamp", "chat_id_hash", "event"]
+    out = open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout
     try:
-        LOGS_WS.append_row([datetime.utcnow().isoformat(), hash_chat_id(chat_id), event])
-    except Exception as e:
-        log.warning("Не удалось записать лог (%s): %s", event, e)
-
-# Антиспам: 1 событие / 2 сек на чат
-_LAST_EVENT_AT = {}
-RATE_WINDOW_SEC = 2.0
-def rate_ok(chat_id: int) -> bool:
-    now = time.monotonic()
-    last = _LAST_EVENT_AT.get(chat_id, 0.0)
-    if now - last < RATE_WINDOW_SEC:
-        return False
-    _LAST_EVENT_AT[chat_id] = now
-    return True
+        if args.format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(header)
+            for row in export_rows(args.kind):
+                writer.writerow(row)
+        else:
+            for row in export_rows(args.kind):
+                out.write(json.dumps(dict(zip(header, row)), ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+# ---------- Антиспам ----------
+class TokenBucketLimiter:
+    """Token bucket на чат плюс общий бакет на все чаты.
+
+    Хранится в форме GCRA: на ключ одно число — «теоретическое время прихода» следующего
+    события. Ключи лежат в порядке последнего обращения; когда бакет снова полон, запись
+    не нужна и вытесняется с головы — память ограничена числом чатов, активных за burst/rate
+    секунд (и жёстко — max_keys). Всё за O(1) на событие.
+    """
+
+    def __init__(self, rate: float, burst: int, global_rate: float = 0.0, global_burst: int = 0,
+                 max_keys: int = 100_000, name: str = "rate"):
+        self.name = name
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self.global_tolerance = (global_burst - 1) * self.global_interval if global_rate else 0.0
+        self.max_keys = max_keys
+        self.tat = OrderedDict()  # key -> время, когда бакет снова станет полным (минус burst)
+        self.rejected = 0
+
+    def _evict(self, now: float):
+        tat = self.tat
+        while tat:
+            key, t = next(iter(tat.items()))
+            if t > now and len(tat) <= self.max_keys:
+                break
+            del tat[key]
+
+    def allow(self, key, now: float = None) -> bool:
+        if now is None:
+            now = time.monotonic()
+        self._evict(now)
+        t = max(self.tat.pop(key, now), now)
+        if t - now > self.tolerance:
+            self.tat[key] = t
+            self.rejected += 1
+            return False
+        # общий бакет — в SHARED, чтобы лимит держался на все воркеры сразу
+        if self.global_interval and not SHARED.take_token(self.name, self.global_interval, self.global_tolerance):
+            self.tat[key] = t
+            self.rejected += 1
+            return False
+        self.tat[key] = t + self.interval
+        return True
+
+    def reserve(self, key, now: float = None) -> float:
+        """Бронирует событие для key и возвращает, сколько секунд ждать до него (0 — можно сразу).
+        Общий бакет здесь не учитывается."""
+        if now is None:
+            now = time.monotonic()
+        self._evict(now)
+        t = max(self.tat.pop(key, now), now)
+        self.tat[key] = t + self.interval
+        return max(0.0, t - self.tolerance - now)
+
+    def hold(self, key, seconds: float, now: float = None):
+        """Ближайшие seconds секунд событий для key не будет (после 429 с retry_after)."""
+        if now is None:
+            now = time.monotonic()
+        self.tat.pop(key, None)
+        self.tat[key] = now + seconds + self.tolerance
+
+def _rate_env(name: str, default: str) -> tuple:
+    """«rate,burst[,global_rate,global_burst]» -> кортеж чисел (rate — событий в секунду)."""
+    parts = [float(p) for p in os.getenv(name, default).split(",")]
+    return tuple(parts) + (0.0, 0.0)[:4 - len(parts)]
+
+# Лёгкие команды (/privacy, /terms, /about ...), шаги интервью и дорогая генерация — отдельно
+RATE_LIMITS = {
+    "cheap": _rate_env("RATE_LIMIT_CHEAP", "0.5,4"),
+    "flow": _rate_env("RATE_LIMIT_FLOW", "1,5"),
+    "generate": _rate_env("RATE_LIMIT_GENERATE", "0.05,2,5,20"),  # 1 генерация / 20 с на чат, всего до 5/с
+}
+LIMITERS = {
+    kind: TokenBucketLimiter(rate, int(burst), g_rate, int(g_burst), name=f"rate:{kind}")
+    for kind, (rate, burst, g_rate, g_burst) in RATE_LIMITS.items()
+}
+
+def rate_ok(chat_id: int, kind: str = "flow") -> bool:
+    if LIMITERS[kind].allow(chat_id):
+        return True
+    METRICS.inc("bot_rate_limited_total", kind=kind)
+    return False
+
+# ---------- Планировщик отправки ----------
+# Telegram: ~30 сообщений/с на бота и ~1/с в один чат (короткие всплески терпит).
+SEND_LIMIT_GLOBAL = _rate_env("SEND_LIMIT_GLOBAL", "30,30")
+SEND_LIMIT_CHAT = _rate_env("SEND_LIMIT_CHAT", "1,3")
+SEND_QUEUE_MAX = int(os.getenv("SEND_QUEUE_MAX", "2000"))  # ожидающих отправки на полосу
+SEND_RETRIES = int(os.getenv("SEND_RETRIES", "3"))  # повторов после 429
+SEND_LANES = ("flow", "info", "admin")  # по убыванию приоритета
+
+SEND_LANE = contextvars.ContextVar("send_lane", default="info")
+
+def send_lane(lane: str):
+    """Отправки из хендлера (и запущенных им задач) идут в полосу lane."""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(update, context):
+            token = SEND_LANE.set(lane)
+            try:
+                return await fn(update, context)
+            finally:
+                SEND_LANE.reset(token)
+        return wrapper
+    return deco
+
+class SendQueueFull(TelegramError):
+    pass
+
+class SendScheduler(BaseRateLimiter):
+    """Все запросы бота с chat_id проходят через полосы приоритета.
+
+    Сначала ждём свой слот в бакете чата (reserve — очередь внутри чата FIFO), потом
+    встаём в общую кучу: диспетчер выдаёт глобальные токены по приоритету полосы
+    (шаги интервью -> информационные команды -> сводки админу). Глобальный бакет — в SHARED,
+    общий для всех воркеров. На 429 чат «замораживается» на retry_after и запрос
+    встаёт в очередь заново. Полоса ограничена SEND_QUEUE_MAX ожидающими.
+    """
+
+    def __init__(self, global_limit: tuple = SEND_LIMIT_GLOBAL, chat_limit: tuple = SEND_LIMIT_CHAT,
+                 max_queued: int = SEND_QUEUE_MAX, retries: int = SEND_RETRIES):
+        g_rate, g_burst = global_limit[:2]
+        self.global_interval = 1.0 / g_rate
+        self.global_tolerance = (g_burst - 1) * self.global_interval
+        self.chats = TokenBucketLimiter(chat_limit[0], int(chat_limit[1]), name="send:chat")
+        self.max_queued = max_queued
+        self.retries = retries
+        self.queued = dict.fromkeys(SEND_LANES, 0)
+        self.chat_locks = {}  # chat_id -> [Lock, сколько ждут]
+        self.heap = []
+        self.seq = 0
+        self._ready = asyncio.Event()
+        self._task = None
+
+    async def initialize(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _dispatch(self):
+        heap = self.heap
+        while True:
+            if not heap:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            if not SHARED.take_token("send:global", self.global_interval, self.global_tolerance):
+                await asyncio.sleep(self.global_interval)
+                continue
+            while heap:
+                _, _, fut = heapq.heappop(heap)
+                if not fut.done():  # отменённые ожидания токен не тратят
+                    fut.set_result(None)
+                    break
+
+    async def _global_slot(self, lane: str):
+        fut = asyncio.get_running_loop().create_future()
+        self.seq += 1
+        heapq.heappush(self.heap, (SEND_LANES.index(lane), self.seq, fut))
+        self._ready.set()
+        await fut
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if chat_id is None:  # getMe, getUpdates, setWebhook ... — без очереди
+            return await callback(*args, **kwargs)
+        lane = rate_limit_args if rate_limit_args in SEND_LANES else SEND_LANE.get()
+        if self.queued[lane] >= self.max_queued:
+            METRICS.inc("bot_send_dropped_total", lane=lane)
+            raise SendQueueFull(f"Очередь отправки «{lane}» переполнена")
+        self.queued[lane] += 1
+        # сообщения одного чата — строго по очереди: слот чата бронируем, когда предыдущее
+        # уже ушло, иначе задержанные в общей куче потом вылетят пачкой и словят 429
+        entry = self.chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await self._send(lane, chat_id, callback, args, kwargs)
+        finally:
+            self.queued[lane] -= 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[chat_id]
+
+    async def _send(self, lane, chat_id, callback, args, kwargs):
+        for attempt in range(self.retries + 1):
+            started = time.monotonic()
+            delay = self.chats.reserve(chat_id)
+            if delay:
+                await asyncio.sleep(delay)
+            await self._global_slot(lane)
+            METRICS.observe("bot_send_wait_seconds", time.monotonic() - started, lane=lane)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                METRICS.inc("bot_send_retry_after_total", lane=lane)
+                if attempt == self.retries:
+                    raise
+                self.chats.hold(chat_id, e.retry_after)
+
+SEND_SCHEDULER = SendScheduler()
+METRICS.gauge("bot_send_queued", lambda: sum(SEND_SCHEDULER.queued.values()))
 
 # ---------- Тексты /privacy и /terms ----------
 PRIVACY_TEXT = (
@@ -206,6 +1788,7 @@ TERMS_TEXT = (
 
 # ---------- Состояния диалога ----------
 CONSENT, BUDGET, SKILLS, TIMEPW = range(4)
+INTERVIEW_FIELDS = ("budget", "skills", "time_per_week")  # ответы интервью в user_data
 
 START_TEXT = (
     "Привет! Я 🤖 *AI Idea Lab*.\n\n"
@@ -214,16 +1797,338 @@ START_TEXT = (
     "Если согласен — напиши *СОГЛАСЕН* (именно это слово)."
 )
 
+# ---------- Постепенный вывод ----------
+STREAM_EDIT_INTERVAL_SEC = float(os.getenv("STREAM_EDIT_INTERVAL_SEC", "1.2"))  # не чаще 1 правки в N сек
+STREAM_MIN_DELTA_CHARS = int(os.getenv("STREAM_MIN_DELTA_CHARS", "60"))  # и не меньше N новых символов
+TG_MESSAGE_LIMIT = 4096
+
+def split_message(text: str, limit: int = TG_MESSAGE_LIMIT) -> list:
+    """Режет текст на куски не длиннее limit, по возможности — по переносам строк."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """Показывает растущий текст в сообщении-заглушке: правки не чаще interval
+    и только если добавилось хотя бы min_delta символов. Без разметки — до финала
+    Markdown может быть незакрытым."""
+
+    def __init__(self, message, interval: float = STREAM_EDIT_INTERVAL_SEC, min_delta: int = STREAM_MIN_DELTA_CHARS):
+        self.message = message
+        self.interval = interval
+        self.min_delta = min_delta
+        self.text = ""
+        self.shown = 0
+        self.edits = 0
+        self._changed = asyncio.Event()
+        self._task = None
+
+    def update(self, text: str):
+        self.text = text
+        if len(text) - self.shown >= self.min_delta:
+            self._changed.set()
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            text = self.text
+            try:
+                await self.message.edit_text(text[:TG_MESSAGE_LIMIT - 2] + " ▌")
+                self.shown = len(text)
+                self.edits += 1
+            except TelegramError as e:
+                log.debug("Промежуточная правка не удалась: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def finish(self, final_text: str):
+        """Заменяет заглушку итоговым текстом (Markdown, при ошибке разметки — как есть)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        first, *rest = split_message(final_text)
+        try:
+            await self.message.edit_text(first, parse_mode=ParseMode.MARKDOWN)
+        except BadRequest as e:
+            if "not modified" not in str(e):
+                await self.message.edit_text(first)
+        for chunk in rest:
+            try:
+                await self.message.reply_text(chunk, parse_mode=ParseMode.MARKDOWN)
+            except BadRequest:
+                await self.message.reply_text(chunk)
+
+# ---------- Уведомления админу ----------
+ADMIN_DIGEST_SEC = float(os.getenv("ADMIN_DIGEST_SEC", "60"))  # как часто отправлять сводку
+ADMIN_DIGEST_MAX = int(os.getenv("ADMIN_DIGEST_MAX", "1000"))  # лидов в очереди, дальше — отбрасываем
+
+class AdminDigest:
+    """Очередь уведомлений о лидах. Хендлер только кладёт лид; фоновая задача раз в
+    ADMIN_DIGEST_SEC склеивает накопленное в сводку, режет по 4096 символов и шлёт
+    по очереди; 429 выжидает SEND_SCHEDULER."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.buf = deque()
+        self.dropped = 0
+        self.sent = 0
+        self.messages = 0
+
+    def put(self, budget: str, skills: str, timepw: str, ideas: str) -> bool:
+        if len(self.buf) >= self.max_size:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                log.warning("Очередь уведомлений админу переполнена — отброшено: %d", self.dropped)
+            return False
+        self.buf.append(
+            f"💰 Бюджет: {budget}\n"
+            f"🧠 Навыки: {skills}\n"
+            f"⏱ Время: {timepw}\n\n"
+            f"💡 Идеи:\n{ideas}"
+        )
+        return True
+
+    def render(self, leads: list) -> list:
+        """Раскладывает лиды по сообщениям до 4096 символов: [(число лидов, [куски текста]), ...].
+        Лид длиннее лимита идёт отдельным сообщением, порезанным split_message."""
+        sep = "\n\n" + "—" * 10 + "\n\n"
+        groups, cur = [], []
+
+        def close():
+            if cur:
+                title = "📥 *Новый лид!*" if len(cur) == 1 else f"📥 *Новые лиды: {len(cur)}*"
+                groups.append((len(cur), split_message(title + "\n\n" + sep.join(cur))))
+                cur.clear()
+
+        size = 0
+        for lead in leads:
+            if cur and size + len(sep) + len(lead) > TG_MESSAGE_LIMIT - 40:  # запас на заголовок
+                close()
+                size = 0
+            cur.append(lead)
+            size += len(lead) + (len(sep) if len(cur) > 1 else 0)
+        close()
+        return groups
+
+    async def _send(self, bot, text: str):
+        try:
+            await bot.send_message(chat_id=int(ADMIN_CHAT_ID), text=text, parse_mode=ParseMode.MARKDOWN)
+        except BadRequest as e:
+            if "parse" not in str(e).lower():
+                raise
+            # сводка из нескольких лидов может сломать разметку — шлём как есть
+            await bot.send_message(chat_id=int(ADMIN_CHAT_ID), text=text)
+        self.messages += 1
+
+    async def flush(self, bot):
+        """Отправляет всё накопленное. Лиды из неотправленных сообщений возвращаются в очередь."""
+        if not ADMIN_CHAT_ID or not self.buf:
+            return
+        token = SEND_LANE.set("admin")
+        try:
+            leads = list(self.buf)
+            self.buf.clear()
+            done = 0
+            for count, chunks in self.render(leads):
+                try:
+                    for chunk in chunks:
+                        await self._send(bot, chunk)
+                except Exception as e:
+                    log.warning("Не удалось отправить сводку админу: %s", e)
+                    # повторим на следующем тике, сколько влезет
+                    rest = leads[done:]
+                    room = max(0, self.max_size - len(self.buf))
+                    self.buf.extendleft(reversed(rest[:room]))
+                    self.dropped += max(0, len(rest) - room)
+                    break
+                done += count
+                self.sent += count
+        finally:
+            SEND_LANE.reset(token)
+
+ADMIN_DIGEST = AdminDigest(ADMIN_DIGEST_MAX)
+METRICS.gauge("bot_admin_digest_queued", lambda: len(ADMIN_DIGEST.buf))
+METRICS.gauge("bot_admin_digest_dropped", lambda: ADMIN_DIGEST.dropped)
+
+async def admin_digest_job(context: ContextTypes.DEFAULT_TYPE):
+    await ADMIN_DIGEST.flush(context.bot)
+
+# ---------- Спекулятивная генерация ----------
+SPECULATIVE_IDEAS = os.getenv("SPECULATIVE_IDEAS", "0") == "1"  # начинать генерацию сразу после навыков
+SPECULATIVE_PER_CHAT = int(os.getenv("SPECULATIVE_PER_CHAT", "1"))  # одновременных догадок на чат
+SPECULATIVE_MAX_CHATS = int(os.getenv("SPECULATIVE_MAX_CHATS", "10000"))  # дальше старые догадки отменяем
+
+# верхняя граница (часов в неделю) -> как корзина попадает в промпт
+TIME_BUCKETS = ((2, "до 2 часов/нед"), (5, "2–5 часов/нед"), (10, "5–10 часов/нед"), (float("inf"), ">10 часов/нед"))
+
+def time_bucket(text: str):
+    """«>10 часов/нед», «часов 12», «5-7 ч», «1 час в день» -> подпись корзины; None, если чисел нет
+    или часы не понять («2 дня в неделю» — сколько часов в день, неизвестно)."""
+    s = _norm_numbers(text)
+    numbers = [float(n.replace(",", ".")) for n in re.findall(r"\d+(?:[.,]\d+)?", s)]
+    if not numbers:
+        return None
+    if re.search(r"\d\s*(?:дн|день)", s):  # считают дни, а не часы
+        return None
+    hours = max(numbers)
+    if "мин" in s:
+        hours /= 60
+    if re.search(r"в\s*(?:день|сутки)|/\s*(?:день|сут)|ежедневно|каждый день", s):
+        hours *= 7
+    if len(numbers) == 1 and re.search(r"[>+]|больше|более|от ", s):
+        hours += 0.5  # «>10» — это уже следующая корзина; у диапазона «от 5 до 10» граница — максимум
+    for limit, label in TIME_BUCKETS:
+        if hours <= limit:
+            return label
+
+class Speculation:
+    """Фоновая генерация идей для угаданной корзины времени. Пока никто не ждёт,
+    частичный текст копится в partial; catch_time подключает sink — свой StreamingReply."""
+
+    def __init__(self, budget: str, skills: str, bucket: str):
+        self.key = (budget, skills, bucket)
+        self.started = time.perf_counter()
+        self.finished = None
+        self.partial = ""
+        self.sink = None
+        self.cancelled = False
+        self.task = asyncio.create_task(self._run())
+
+    def _on_delta(self, text: str):
+        self.partial = text
+        if self.sink is not None:
+            self.sink(text)
+
+    async def _run(self) -> str:
+        budget, skills, bucket = self.key
+        try:
+            return await generate_ideas(budget, skills, bucket, on_delta=self._on_delta)
+        finally:
+            self.finished = time.perf_counter()
+
+    def cancel(self):
+        self.cancelled = True
+        self.task.cancel()
+
+class Speculator:
+    """Догадки по чатам. Задачи держим здесь, а не в user_data: persistence пишет его в JSON.
+    Корзину угадываем по частоте реальных ответов (пока их нет — «>10 часов/нед»)."""
+
+    def __init__(self, per_chat: int, max_chats: int):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self.live = OrderedDict()  # chat_id -> [Speculation]
+        self.bucket_counts = {TIME_BUCKETS[-1][1]: 1}
+        self.started = self.hits = self.misses = self.skipped = 0
+        self.saved_sec = 0.0
+
+    def predict(self) -> str:
+        return max(self.bucket_counts, key=self.bucket_counts.get)
+
+    def start(self, chat_id: int, budget: str, skills: str):
+        specs = [s for s in self.live.pop(chat_id, []) if not s.cancelled]
+        for s in specs:
+            if s.key[:2] != (budget, skills):  # ответы поменялись — догадка устарела
+                s.cancel()
+        specs = [s for s in specs if not s.cancelled and not s.task.done()]
+        if len(specs) >= self.per_chat:
+            self.skip()
+        else:
+            specs.append(Speculation(budget, skills, self.predict()))
+            self.started += 1
+            METRICS.inc("bot_speculative_total", result="started")
+        self.live[chat_id] = specs
+        while len(self.live) > self.max_chats:
+            _, old = self.live.popitem(last=False)
+            for s in old:
+                s.cancel()
+
+    def skip(self):
+        """Догадку не запускаем: лимит догадок на чат или генераций исчерпан."""
+        self.skipped += 1
+        METRICS.inc("bot_speculative_total", result="skipped")
+
+    def take(self, chat_id: int, budget: str, skills: str, time_per_week: str):
+        """Догадка, совпавшая с реальным ответом (по корзине), или None. Остальные отменяются."""
+        bucket = time_bucket(time_per_week)
+        if bucket is not None:
+            self.bucket_counts[bucket] = self.bucket_counts.get(bucket, 0) + 1
+        specs = self.live.pop(chat_id, None)
+        if not specs:
+            return None
+        match = None
+        for s in specs:
+            if match is None and not s.cancelled and s.key == (budget, skills, bucket):
+                match = s
+            else:
+                s.cancel()
+        if match is None:
+            self.misses += 1
+            METRICS.inc("bot_speculative_total", result="miss")
+            return None
+        self.hits += 1
+        # сэкономлено столько, сколько генерация успела пройти до ответа пользователя
+        saved = (match.finished or time.perf_counter()) - match.started
+        self.saved_sec += saved
+        METRICS.inc("bot_speculative_total", result="hit")
+        METRICS.observe("bot_speculative_saved_seconds", saved)
+        return match
+
+    def stats(self) -> dict:
+        taken = self.hits + self.misses
+        return {
+            "started": self.started, "hits": self.hits, "misses": self.misses, "skipped": self.skipped,
+            "hit_rate": round(self.hits / taken, 3) if taken else 0.0, "saved_sec": round(self.saved_sec, 1),
+        }
+
+SPECULATOR = Speculator(SPECULATIVE_PER_CHAT, SPECULATIVE_MAX_CHATS)
+METRICS.gauge("bot_speculative_hit_rate", lambda: SPECULATOR.stats()["hit_rate"])
+METRICS.gauge("bot_speculative_live_chats", lambda: len(SPECULATOR.live))
+
+async def speculative_ideas(spec: Speculation, on_delta) -> str:
+    """Дожидается догадки, показывая её текст через on_delta. Задачу не отменяем, даже если
+    отменят нас: её результат всё равно ляжет в кэш. None — догадка отменена или не удалась
+    (FALLBACK_IDEAS), тогда генерируем как обычно."""
+    spec.sink = on_delta
+    if spec.partial:
+        on_delta(spec.partial)
+    try:
+        ideas = await asyncio.shield(spec.task)
+        return None if ideas == FALLBACK_IDEAS else ideas
+    except asyncio.CancelledError:
+        if spec.task.cancelled():  # отменили саму догадку — генерируем как обычно
+            return None
+        raise
+
 # ---------- Хендлеры ----------
+@timed_handler
+@send_lane("flow")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id):
         return
-    log_event(update.effective_chat.id, "start")
+    log_event(chat, "start")
     await update.message.reply_text(START_TEXT, parse_mode=ParseMode.MARKDOWN)
     return CONSENT
 
+@timed_handler
+@send_lane("flow")
 async def consent_catch(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id):
         return CONSENT
     text = (update.message.text or "").strip().upper()
     if text != "СОГЛАСЕН":
@@ -234,7 +2139,7 @@ async def consent_catch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return CONSENT
 
-    log_event(update.effective_chat.id, "consent_accepted")
+    log_event(chat, "consent_accepted")
     await update.message.reply_text(
         "Ок! Начинаем.\n\n"
         "💰 Сколько денег готов вложить на старте?\n_Примеры: 0, 1000, 5000_",
@@ -242,80 +2147,109 @@ async def consent_catch(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return BUDGET
 
+@timed_handler
+@send_lane("flow")
 async def catch_budget(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id):
         return BUDGET
     context.user_data["budget"] = (update.message.text or "").strip()
-    log_event(update.effective_chat.id, "budget_provided")
+    log_event(chat, "budget_provided")
     await update.message.reply_text("🧠 Какие у тебя навыки или интересы? _Напиши через запятую_", parse_mode=ParseMode.MARKDOWN)
     return SKILLS
 
+@timed_handler
+@send_lane("flow")
 async def catch_skills(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id):
         return SKILLS
     context.user_data["skills"] = (update.message.text or "").strip()
-    log_event(update.effective_chat.id, "skills_provided")
+    log_event(chat, "skills_provided")
+    if SPECULATIVE_IDEAS and OPENAI_API_KEY:
+        # догадка — та же генерация и под тем же лимитом; её токен catch_time при попадании не берёт снова
+        if rate_ok(chat.id, "generate"):
+            SPECULATOR.start(chat.id, context.user_data.get("budget", ""), context.user_data["skills"])
+        else:
+            SPECULATOR.skip()
     await update.message.reply_text("⏱ Сколько времени готов уделять в неделю?\n_Пример: >10 часов/нед_", parse_mode=ParseMode.MARKDOWN)
     return TIMEPW
 
+@timed_handler
+@send_lane("flow")
 async def catch_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
-        return ConversationHandler.END
-    context.user_data["time_per_week"] = (update.message.text or "").strip()
-    await update.message.reply_text("⏳ Генерирую идеи... это займёт пару секунд ⌛")
-
+    chat = chat_context(update)
+    timepw = (update.message.text or "").strip()
     budget = context.user_data.get("budget", "")
     skills = context.user_data.get("skills", "")
-    timepw = context.user_data.get("time_per_week", "")
+    spec = SPECULATOR.take(chat.id, budget, skills, timepw) if SPECULATIVE_IDEAS else None
+    if spec is None and not rate_ok(chat.id, "generate"):
+        # ответ не теряем молча: пусть пришлёт его ещё раз чуть позже (сам отказ — по лёгкому лимиту)
+        if rate_ok(chat.id, "cheap"):
+            await update.message.reply_text("⏳ Сейчас много запросов — подожди немного и отправь ответ ещё раз.")
+        return TIMEPW
+    context.user_data["time_per_week"] = timepw
+    placeholder = await update.message.reply_text("⏳ Генерирую идеи... это займёт пару секунд ⌛")
 
-    ideas = generate_ideas(budget, skills, timepw)
-
-    # Сохраняем минимум и только хэш чата
+    stream = StreamingReply(placeholder)
+    stream.start()
+    ideas = None
+    if spec is not None:
+        ideas = await speculative_ideas(spec, stream.update)
+    if ideas is None:
+        ideas = await generate_ideas(budget, skills, timepw, on_delta=stream.update)
+    # Сохраняем минимум и только хэш чата (в Google Sheet попадёт через sync_sheet_replica).
+    # До отправки: finish может упасть (таймаут, 429, очередь), а лид терять нельзя.
     try:
-        chat_id_hash = hash_chat_id(update.effective_chat.id)
-        SHEET.append_row([
-            datetime.utcnow().isoformat(),
-            chat_id_hash,
+        LEADS.append([
+            chat.ts,
+            chat.hash,
             budget,
             skills,
             timepw,
             ideas
         ])
+        STATS.invalidate()
     except Exception as e:
-        log.error("Ошибка записи в Google Sheet: %s", e)
+        log.error("Ошибка записи лида: %s", e)
 
-    log_event(update.effective_chat.id, "ideas_generated")
+    log_event(chat, "ideas_generated")
 
-    # Уведомление админу (если задан)
-    try:
-        if ADMIN_CHAT_ID:
-            await context.bot.send_message(
-                chat_id=int(ADMIN_CHAT_ID),
-                text=(
-                    "📥 *Новый лид!*\n\n"
-                    f"💰 Бюджет: {budget}\n"
-                    f"🧠 Навыки: {skills}\n"
-                    f"⏱ Время: {timepw}\n\n"
-                    f"💡 Идеи:\n{ideas}"
-                ),
-                parse_mode=ParseMode.MARKDOWN
-            )
-    except Exception as e:
-        log.warning("Не удалось отправить уведомление админу: %s", e)
+    # Уведомление админу (если задан) — уйдёт в ближайшей сводке
+    if ADMIN_CHAT_ID:
+        ADMIN_DIGEST.put(budget, skills, timepw, ideas)
+    # ответы уже в лиде (под хэшем) — в persistence под id пользователя их не держим
+    for field in INTERVIEW_FIELDS:
+        context.user_data.pop(field, None)
 
-    await update.message.reply_text(
-        "✅ Готово! Вот идеи под твои условия:\n\n"
-        f"{ideas}\n\n"
-        "Если хочешь — напиши */more* и я докину дополнительные шаги запуска.\n\n"
-        "Команды: /privacy /terms /erase /about",
-        parse_mode=ParseMode.MARKDOWN
-    )
+    try:
+        await stream.finish(
+            "✅ Готово! Вот идеи под твои условия:\n\n"
+            f"{ideas}\n\n"
+            "Если хочешь — напиши */more* и я докину дополнительные шаги запуска.\n\n"
+            "Команды: /privacy /terms /erase /about"
+        )
+    except TelegramError as e:
+        # лид уже сохранён; диалог завершаем — повторный /start отдаст идеи из кэша
+        log.warning("Не удалось показать идеи: %s", e)
+        METRICS.inc("bot_errors_total", type=type(e).__name__)
     return ConversationHandler.END
 
+@timed_handler
+@send_lane("flow")
+async def still_generating(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сообщения, пришедшие, пока catch_time ещё генерирует (состояние WAITING)."""
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
+        return
+    await update.message.reply_text("⏳ Ещё генерирую идеи — пришлю, как только будут готовы.")
+
+@timed_handler
 async def more(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
-    log_event(update.effective_chat.id, "more")
+    log_event(chat, "more")
     await update.message.reply_text(
         "🔧 Доп.шаги:\n"
         "1) Выбери 1 идею и опиши её в 10 строк (что/для кого/ценность).\n"
@@ -326,22 +2260,28 @@ async def more(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN,
     )
 
+@timed_handler
 async def privacy(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
-    log_event(update.effective_chat.id, "privacy")
+    log_event(chat, "privacy")
     await update.message.reply_text(PRIVACY_TEXT, parse_mode=ParseMode.MARKDOWN)
 
+@timed_handler
 async def terms(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
-    log_event(update.effective_chat.id, "terms")
+    log_event(chat, "terms")
     await update.message.reply_text(TERMS_TEXT, parse_mode=ParseMode.MARKDOWN)
 
+@timed_handler
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
-    log_event(update.effective_chat.id, "about")
+    log_event(chat, "about")
     await update.message.reply_text(
         "🤖 *AI Idea Lab*\n\n"
         "Этот бот подбирает идеи микробизнеса под твой бюджет, навыки и время.\n\n"
@@ -357,91 +2297,367 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.MARKDOWN
     )
 
+@timed_handler
 async def erase(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
     """Удаляет все строки, относящиеся к этому пользователю (по chat_id_hash)."""
-    log_event(update.effective_chat.id, "erase_called")
+    log_event(chat, "erase_called")
     try:
-        chat_id_hash = hash_chat_id(update.effective_chat.id)
-        data = SHEET.get_all_values()
-        if len(data) <= 1:
-            await update.message.reply_text("Нечего удалять — данных нет.")
+        # локально — индексный DELETE; в Google Sheet удалит sync_sheet_replica
+        deleted = LEADS.delete_by_hash(chat.hash)
+        STATS.invalidate()
+        # ответы интервью и состояние диалога хранятся под настоящим id — удаляем и их
+        user_id = update.effective_user.id if update.effective_user else chat.id
+        context.application.drop_user_data(user_id)
+        persistence = context.application.persistence
+        if isinstance(persistence, SqlitePersistence):
+            persistence.drop_chat(chat.id, user_id)
+        if not deleted and LEADS.get_meta("sheet_backfill") != "done":
+            # старые строки таблицы ещё не перенесены — удаление там уже в очереди
+            log_event(chat, "erase_queued")
+            await update.message.reply_text(
+                "Запрос принят ✅ Если в таблице остались твои старые записи, они будут удалены в ближайшие минуты.")
             return
-
-        to_delete = []
-        for idx, row in enumerate(data[1:], start=2):
-            if len(row) > 1 and row[1] == chat_id_hash:
-                to_delete.append(idx)
-
-        if not to_delete:
+        if not deleted:
             await update.message.reply_text("Данных по тебе не найдено. Уже чисто ✨")
             return
 
-        for r in reversed(to_delete):
-            SHEET.delete_rows(r)
-        log_event(update.effective_chat.id, f"erase_done:{len(to_delete)}")
-        await update.message.reply_text(f"Готово. Удалено записей: {len(to_delete)} ✅")
+        log_event(chat, f"erase_done:{deleted}")
+        await update.message.reply_text(f"Готово. Удалено записей: {deleted} ✅")
     except Exception as e:
         log.error("Ошибка при /erase: %s", e)
         await update.message.reply_text("Не удалось удалить данные. Попробуй позже.")
 
 # ---------- Глобальная очистка всех данных (только для администратора) ----------
+@timed_handler
 async def admin_clear_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return ConversationHandler.END
-    if str(update.effective_chat.id) != str(ADMIN_CHAT_ID):
+    if str(chat.id) != str(ADMIN_CHAT_ID):
         await update.message.reply_text("🚫 У тебя нет прав для этой команды.")
         return ConversationHandler.END
 
-    log_event(update.effective_chat.id, "admin_clear_requested")
+    log_event(chat, "admin_clear_requested")
     await update.message.reply_text(
         "⚠️ ВНИМАНИЕ: это удалит *все данные всех пользователей* без возможности восстановления.\n\n"
         "Если ты точно уверен — напиши: ПОДТВЕРЖДАЮ"
     )
     return 1
 
+@timed_handler
 async def admin_clear_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return ConversationHandler.END
-    if str(update.effective_chat.id) != str(ADMIN_CHAT_ID):
+    if str(chat.id) != str(ADMIN_CHAT_ID):
         await update.message.reply_text("🚫 У тебя нет прав для этой команды.")
         return ConversationHandler.END
 
     if update.message.text.strip().upper() == "ПОДТВЕРЖДАЮ":
         try:
-            SHEET.clear()
-            SHEET.append_row(["timestamp", "chat_id_hash", "budget", "skills", "time_per_week", "ideas_text"])
-            log_event(update.effective_chat.id, "admin_clear_done")
-            await update.message.reply_text("🧹 Все данные успешно удалены ✅")
+            LEADS.clear()
+            IDEAS_CACHE.clear()
+            LEADS.set_meta("sheet_backfill", "done")  # строки листа удаляются намеренно — не переносить их обратно
+            LEADS.set_meta("sheet_clear", "pending")  # лист очистит sync_sheet_replica, если не выйдет сейчас
+            STATS.invalidate()
         except Exception as e:
             log.error("Ошибка при глобальной очистке: %s", e)
             await update.message.reply_text("❌ Ошибка при удалении данных.")
+            return ConversationHandler.END
+        log_event(chat, "admin_clear_done")
+        done = "🧹 Все данные успешно удалены ✅"
+        if SHEET:
+            try:
+                await clear_sheet_replica()
+            except Exception as e:
+                log.warning("Не удалось очистить Google Sheet: %s", e)
+                done += "\nGoogle Sheet очистится в фоне."
+        else:
+            done += "\nGoogle Sheet ещё подключается — очистится в фоне."
+        await update.message.reply_text(done)
     else:
         await update.message.reply_text("❌ Очистка отменена.")
     return ConversationHandler.END
 
+@timed_handler
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка для админа: лиды, воронка по событиям, бюджеты и топ навыков."""
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
+        return
+    if str(chat.id) != str(ADMIN_CHAT_ID):
+        await update.message.reply_text("🚫 У тебя нет прав для этой команды.")
+        return
+    try:
+        snap = await STATS.get(LEADS, LOGS_WS)
+    except Exception as e:
+        log.error("Ошибка при /stats: %s", e)
+        await update.message.reply_text("❌ Не удалось посчитать статистику.")
+        return
+    await update.message.reply_text(format_stats(snap))
+
+@timed_handler
+@send_lane("flow")
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    for field in INTERVIEW_FIELDS:
+        context.user_data.pop(field, None)
     await update.message.reply_text("Ок, завершаю. Можешь написать /start, когда будешь готов.")
     return ConversationHandler.END
 
+@timed_handler
 async def not_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not rate_ok(update.effective_chat.id):
+    chat = chat_context(update)
+    if not rate_ok(chat.id, "cheap"):
         return
-    log_event(update.effective_chat.id, "non_text_message")
+    log_event(chat, "non_text_message")
     await update.message.reply_text("Пожалуйста, ответь текстом. Если хочешь начать заново — /start")
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     log.exception("Ошибка в обработке апдейта: %s", context.error)
+    METRICS.inc("bot_errors_total", type=type(context.error).__name__)
+    if isinstance(context.error, (RetryAfter, SendQueueFull)):
+        return  # Telegram и так не даёт писать в этот чат — ответ тоже не уйдёт
     try:
         if isinstance(update, Update) and update.effective_message:
             await update.effective_message.reply_text("Ой! Что-то пошло не так. Попробуй ещё раз 🙏")
     except Exception:
         pass
 
+# ---------- Состояние диалогов ----------
+PERSISTENCE = os.getenv("PERSISTENCE", "sqlite")  # sqlite | pickle | none
+PERSISTENCE_PATH = os.getenv("PERSISTENCE_PATH", "bot_state.pickle" if PERSISTENCE == "pickle" else "bot_state.db")
+PERSISTENCE_FLUSH_SEC = float(os.getenv("PERSISTENCE_FLUSH_SEC", "5"))  # как часто PTB сбрасывает изменения
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "0") == "1"  # по умолчанию доигрываем очередь после рестарта
+
+class SqlitePersistence(BasePersistence):
+    """user_data и состояния ConversationHandler в SQLite (JSON в key-value таблице).
+
+    PTB сам копит изменения и отдаёт их раз в update_interval; все записи одного
+    такого прохода мы коммитим одной транзакцией (commit откладывается на следующий тик).
+    Ключи здесь — настоящие id Telegram, поэтому пустой user_data не храним, /erase
+    удаляет строки чата (drop_chat), а записи старше RETENTION_DAYS чистит prune_state_job.
+    """
+
+    def __init__(self, path: str, update_interval: float = PERSISTENCE_FLUSH_SEC):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS state (kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL DEFAULT 0, PRIMARY KEY (kind, key))"
+        )
+        if "updated_at" not in {r[1] for r in self.db.execute("PRAGMA table_info(state)")}:
+            # база до появления срока хранения: отсчитываем его с момента обновления
+            self.db.execute("ALTER TABLE state ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+            self.db.execute("UPDATE state SET updated_at = ?", (time.time(),))
+        self.db.execute("CREATE INDEX IF NOT EXISTS state_updated_at ON state(updated_at)")
+        self.db.commit()
+        self.writes = 0
+        self.commits = 0
+        self._commit_pending = False
+
+    def _write(self, kind: str, key: str, value):
+        if value is None:
+            self.db.execute("DELETE FROM state WHERE kind = ? AND key = ?", (kind, key))
+        else:
+            self.db.execute(
+                "INSERT INTO state (kind, key, value, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (kind, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                (kind, key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+        self.writes += 1
+        if not self._commit_pending:
+            self._commit_pending = True
+            asyncio.get_running_loop().call_soon(self._commit)
+
+    def _commit(self):
+        self._commit_pending = False
+        self.db.commit()
+        self.commits += 1
+
+    def _read(self, kind: str) -> dict:
+        return {k: json.loads(v) for k, v in self.db.execute("SELECT key, value FROM state WHERE kind = ?", (kind,))}
+
+    async def get_user_data(self) -> dict:
+        return {int(k): v for k, v in self._read("user").items()}
+
+    async def update_user_data(self, user_id: int, data: dict):
+        self._write("user", str(user_id), data or None)
+
+    async def drop_user_data(self, user_id: int):
+        self._write("user", str(user_id), None)
+
+    async def get_conversations(self, name: str) -> dict:
+        return {tuple(json.loads(k)): v for k, v in self._read(f"conv:{name}").items()}
+
+    async def update_conversation(self, name: str, key, new_state):
+        # завершённый неблокирующим шагом диалог PTB отдаёт как END, а не None — не храним и его
+        if new_state == ConversationHandler.END:
+            new_state = None
+        self._write(f"conv:{name}", json.dumps(list(key)), new_state)
+
+    async def flush(self):
+        self._commit()
+
+    def drop_chat(self, chat_id: int, user_id: int):
+        """/erase: user_data и состояние диалогов этого чата — сразу и с коммитом."""
+        with self.db:
+            self.db.execute("DELETE FROM state WHERE kind = 'user' AND key = ?", (str(user_id),))
+            self.db.execute("DELETE FROM state WHERE kind LIKE 'conv:%' AND key = ?",
+                            (json.dumps([chat_id, user_id]),))
+
+    def prune_before(self, cutoff_ts: float) -> list:
+        """Удаляет записи, не обновлявшиеся с cutoff_ts; возвращает id пользователей,
+        чьи user_data удалены (их надо выкинуть и из памяти Application)."""
+        with self.db:
+            users = [int(k) for (k,) in self.db.execute(
+                "SELECT key FROM state WHERE kind = 'user' AND updated_at < ?", (cutoff_ts,))]
+            self.db.execute("DELETE FROM state WHERE updated_at < ?", (cutoff_ts,))
+        return users
+
+    # chat_data, bot_data и callback_data боту не нужны
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+async def prune_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Состояние диалогов старше RETENTION_DAYS — из базы и из памяти этого воркера."""
+    persistence = context.application.persistence
+    if not isinstance(persistence, SqlitePersistence):
+        return
+    cutoff = time.time() - RETENTION_DAYS * 86400
+    users = persistence.prune_before(cutoff)
+    for user_id in users:
+        context.application.drop_user_data(user_id)
+    if users:
+        log.info("🧹 Удалено устаревших user_data: %d", len(users))
+
+def make_persistence():
+    if PERSISTENCE == "sqlite":
+        return SqlitePersistence(PERSISTENCE_PATH)
+    if PERSISTENCE == "pickle":
+        return PicklePersistence(PERSISTENCE_PATH, update_interval=PERSISTENCE_FLUSH_SEC)
+    return None
+
 # ---------- Application ----------
+class ChatOrderedApplication(Application):
+    """Апдейты разных чатов — параллельно (concurrent_updates), одного чата — строго по очереди.
+
+    ConversationHandler выбирает хендлер по состоянию ещё до await колбэка: без очереди
+    чата быстрый второй ответ обгонял смену состояния (два catch_time подряд, бюджет,
+    записанный из ответа про время). Долгий шаг (генерация) идёт с block=False и очередь
+    не держит — пока он не кончился, сообщения чата попадают в WAITING.
+
+    process_update вызывается уже под семафором concurrent_updates, поэтому ждать очереди
+    чата в нём нельзя: один флудящий чат занял бы все слоты. Апдейт занятого чата кладём
+    в его очередь и сразу отпускаем слот; очередь разбирает тот, кто обрабатывает чат, —
+    один слот на активный чат. Сверх CHAT_QUEUE_MAX апдейты чата отбрасываются.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._chat_queues = {}  # chat_id -> deque апдейтов, ждущих обработки чата
+
+    async def process_update(self, update: object):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            return await super().process_update(update)
+        pending = self._chat_queues.get(chat.id)
+        if pending is not None:
+            if len(pending) >= CHAT_QUEUE_MAX:
+                METRICS.inc("bot_chat_updates_dropped_total")
+                return
+            pending.append(update)
+            return
+        pending = self._chat_queues[chat.id] = deque()
+        try:
+            await super().process_update(update)
+            while pending:
+                try:
+                    await super().process_update(pending.popleft())
+                except Exception:
+                    log.exception("Ошибка обработки апдейта из очереди чата")
+        finally:
+            del self._chat_queues[chat.id]
+
+_INIT_TASK = None
+_METRICS_SERVER = None
+
+async def _post_init(app: Application):
+    global _INIT_TASK, _METRICS_SERVER
+    EVENT_LOG.start()
+    if METRICS_PORT:
+        port = METRICS_PORT + WORKER_INDEX  # у каждого воркера свой порт
+        _METRICS_SERVER = await asyncio.start_server(_serve_metrics, "0.0.0.0", port)
+        log.info("📈 Метрики: http://0.0.0.0:%d/metrics", port)
+    # не ждём Google — бот начинает отвечать сразу
+    _INIT_TASK = asyncio.create_task(init_backends())
+
+async def _post_stop(app: Application):
+    # бот ещё открыт — отправим хвост сводки до закрытия соединений
+    await ADMIN_DIGEST.flush(app.bot)
+
+async def _post_shutdown(app: Application):
+    if _INIT_TASK and not _INIT_TASK.done():
+        _INIT_TASK.cancel()
+    if _METRICS_SERVER is not None:
+        _METRICS_SERVER.close()
+    await EVENT_LOG.stop()
+    IDEAS_CACHE.save()
+    if client is not None:
+        await client.close()
+
 def build_app() -> Application:
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    builder = (
+        Application.builder()
+        .application_class(ChatOrderedApplication)
+        .token(TELEGRAM_TOKEN)
+        .request(TimedRequest(connection_pool_size=256))
+        .rate_limiter(SEND_SCHEDULER)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .post_shutdown(_post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL.rstrip('/')}/bot")
+    persistence = make_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    app = builder.build()
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -449,10 +2665,15 @@ def build_app() -> Application:
             CONSENT: [MessageHandler(filters.TEXT & ~filters.COMMAND, consent_catch)],
             BUDGET:  [MessageHandler(filters.TEXT & ~filters.COMMAND, catch_budget)],
             SKILLS:  [MessageHandler(filters.TEXT & ~filters.COMMAND, catch_skills)],
-            TIMEPW:  [MessageHandler(filters.TEXT & ~filters.COMMAND, catch_time)],
+            # генерация идёт задачей (block=False): диспетчер не ждёт OpenAI и обрабатывает
+            # другие чаты, а сообщения этого чата до её конца попадают в WAITING
+            TIMEPW:  [MessageHandler(filters.TEXT & ~filters.COMMAND, catch_time, block=False)],
+            ConversationHandler.WAITING: [MessageHandler(filters.TEXT & ~filters.COMMAND, still_generating)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
+        name="interview",
+        persistent=persistence is not None,
     )
 
     app.add_handler(conv)
@@ -468,27 +2689,132 @@ def build_app() -> Application:
         fallbacks=[],
     )
     app.add_handler(admin_clear_conv)
+    app.add_handler(CommandHandler("stats", stats))
 
     app.add_handler(MessageHandler(~filters.TEXT & ~filters.COMMAND, not_text))
     app.add_error_handler(error_handler)
+
+    if WORKER_INDEX == 0:  # реплика и очистка общих хранилищ — в одном процессе
+        app.job_queue.run_repeating(sync_sheet_replica, interval=SHEET_SYNC_SEC, first=SHEET_SYNC_SEC)
+        app.job_queue.run_repeating(retention_job, interval=RETENTION_JOB_SEC, first=60)
+    app.job_queue.run_repeating(save_ideas_cache, interval=300, first=300)
+    if isinstance(persistence, SqlitePersistence):  # в каждом воркере: чистит и его память
+        app.job_queue.run_repeating(prune_state_job, interval=RETENTION_JOB_SEC, first=90)
+    if ADMIN_CHAT_ID:
+        app.job_queue.run_repeating(admin_digest_job, interval=ADMIN_DIGEST_SEC, first=ADMIN_DIGEST_SEC)
     return app
 
+# ---------- Несколько воркеров ----------
+WORKER_QUEUE_MAX = int(os.getenv("WORKER_QUEUE_MAX", "10000"))  # апдейтов в очереди воркера
+
+def update_chat_id(data: dict) -> int:
+    """chat_id (или id пользователя) из сырого апдейта Bot API — ключ шардирования."""
+    for kind, obj in data.items():
+        if kind == "update_id" or not isinstance(obj, dict):
+            continue
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        if obj.get("from"):
+            return int(obj["from"]["id"])
+    return 0
+
+class WebhookDispatchHandler(tornado.web.RequestHandler):
+    """Принимает вебхук и кладёт тело апдейта в очередь воркера chat_id % N."""
+
+    def initialize(self, queues):
+        self.queues = queues
+
+    def post(self):
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        q = self.queues[update_chat_id(data) % len(self.queues)]
+        try:
+            q.put_nowait(self.request.body)
+        except queue.Full:
+            self.set_status(503)  # Telegram повторит доставку позже
+
+async def _worker_loop(updates):
+    app = build_app()
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(raw), app.bot))
+    finally:
+        # порядок как в run_webhook/run_polling: post_stop PTB зовёт только оттуда
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        await app.post_shutdown(app)
+
+def _worker_main(index: int, updates):
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    log.info("👷 Воркер %d запущен (pid %d)", index, os.getpid())
+    asyncio.run(_worker_loop(updates))
+
+async def _serve_dispatcher(queues, webhook_url: str):
+    bot = Bot(TELEGRAM_TOKEN, base_url=f"{TELEGRAM_API_URL.rstrip('/')}/bot" if TELEGRAM_API_URL else None)
+    async with bot:
+        await bot.set_webhook(url=webhook_url, drop_pending_updates=DROP_PENDING_UPDATES)
+    web = tornado.web.Application([(rf"/{re.escape(WEBHOOK_PATH)}/?", WebhookDispatchHandler, {"queues": queues})])
+    server = web.listen(PORT, address="0.0.0.0")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    server.stop()
+
+def run_sharded_webhook(webhook_url: str):
+    """Один HTTP-слушатель + WORKERS процессов; все апдейты чата идут в один и тот же воркер,
+    поэтому диалог и антиспам чата остаются локальными, а общее — в SHARED и SQLite."""
+    ctx = multiprocessing.get_context("spawn")  # без fork: SQLite-соединения не наследуем
+    queues = [ctx.Queue(maxsize=WORKER_QUEUE_MAX) for _ in range(WORKERS)]
+    procs = [ctx.Process(target=_worker_main, args=(i, q), name=f"worker-{i}") for i, q in enumerate(queues)]
+    for p in procs:
+        p.start()
+    try:
+        asyncio.run(_serve_dispatcher(queues, webhook_url))
+    finally:
+        for q in queues:
+            q.put(None)
+        for p in procs:
+            p.join(timeout=30)
+
 # ---------- Запуск ----------
 if __name__ == "__main__":
-    app = build_app()
+    import sys
 
+    if len(sys.argv) > 1:  # python main.py export ... / stats — без запуска бота
+        sys.exit(export_main(sys.argv[1:]))
+    if not TELEGRAM_TOKEN:
+        raise RuntimeError("TELEGRAM_TOKEN не задан")
     if WEBHOOK_BASE_URL:
         webhook_url = f"{WEBHOOK_BASE_URL.rstrip('/')}/{WEBHOOK_PATH}"
         log.info("🌐 Запускаю webhook: %s", webhook_url)
 
-        app.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=WEBHOOK_PATH,
-            webhook_url=webhook_url,
-            drop_pending_updates=True,
-            stop_signals=None,
-        )
+        if WORKERS > 1:
+            log.info("👷 Воркеров: %d", WORKERS)
+            run_sharded_webhook(webhook_url)
+        else:
+            build_app().run_webhook(
+                listen="0.0.0.0",
+                port=PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=webhook_url,
+                drop_pending_updates=DROP_PENDING_UPDATES,
+                stop_signals=None,
+            )
     else:
         log.info("🤖 Бот запущен в режиме polling")
-        app.run_polling(drop_pending_updates=True)
+        build_app().run_polling(drop_pending_updates=DROP_PENDING_UPDATES)